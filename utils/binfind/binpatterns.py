@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
-from sys import argv
+import mmap
+import os
+from sys import argv, stderr
+from argparse import ArgumentParser
+from collections import deque
+from multiprocessing import Pool
 
 # note: turned out lucky with the font, no need to try padding, lsb, or other such variations
 
@@ -9,28 +14,482 @@ def expand_bits_msb(bytestring):
             bitval = (0x80 >> i) & b
             yield 1 if bitval != 0 else 0
 
+def pack_bits_msb(bits):
+    """[1, 0, ...] -> bytes, zero padded at the end to a whole byte"""
+    bits = list(bits) + [0] * (-len(bits) % 8)
+    return bytes(
+        sum(b << (7 - i) for (i, b) in enumerate(bits[off:off + 8]))
+        for off in range(0, len(bits), 8))
+
+class BitPattern:
+    """A bit pattern prepared for searching at byte speed
+
+    The pattern is shifted to each of the 8 possible bit alignments within a byte and packed, with
+    a mask that says which bits of the first and last byte belong to it. The whole bytes in the
+    middle are found with bytes.find, and only those candidates are checked bit by bit.
+    """
+    def __init__(self, bits):
+        self.bits = list(bits)
+        self.nbits = len(self.bits)
+        self.alignments = [self.align(shift) for shift in range(8)]
+
+    def align(self, shift):
+        data = pack_bits_msb([0] * shift + self.bits)
+        mask = pack_bits_msb([0] * shift + [1] * self.nbits)
+        # the longest run of fully specified bytes makes the most selective find() needle
+        (core_start, core_len) = (0, 0)
+        run_start = None
+        for (i, m) in enumerate(mask + b'\0'):
+            if m == 0xff:
+                if run_start is None:
+                    run_start = i
+            elif run_start is not None:
+                if i - run_start > core_len:
+                    (core_start, core_len) = (run_start, i - run_start)
+                run_start = None
+        return (shift, int.from_bytes(data, 'big'), int.from_bytes(mask, 'big'), len(data),
+                data[core_start:core_start + core_len], core_start)
+
+    def find(self, binary):
+        """Bit offsets of every match in binary, in increasing order"""
+        hits = []
+        for (shift, data, mask, nbytes, core, core_start) in self.alignments:
+            last_start = len(binary) - nbytes
+            if core:
+                # byte offsets of the match start, from where the core was found
+                starts = []
+                pos = binary.find(core, core_start)
+                while pos != -1 and pos - core_start <= last_start:
+                    starts.append(pos - core_start)
+                    pos = binary.find(core, pos + 1)
+            else:
+                # too short to have a whole byte at this alignment; check everywhere
+                starts = range(last_start + 1)
+            for start in starts:
+                window = int.from_bytes(binary[start:start + nbytes], 'big')
+                if window & mask == data:
+                    hits.append(8 * start + shift)
+        hits.sort()
+        return hits
+
 def try_find(binary, bit_pattern):
-    pat_len = len(bit_pattern)
-    binary = list(expand_bits_msb(binary))
-    for start_offset in range(len(binary)):
-        if binary[start_offset:start_offset + pat_len] == bit_pattern:
-            print("bits: %s, bytes: %s" % (start_offset, start_offset / 8.0))
+    for start_offset in BitPattern(bit_pattern).find(binary):
+        print("bits: %s, bytes: %s" % (start_offset, start_offset / 8.0))
+
+def unit_test_find():
+    from random import Random
+    rng = Random(1)
+    binary = bytes(rng.getrandbits(8) for _ in range(64)) + b'\xff\x00' * 8
+    bits = list(expand_bits_msb(binary))
+    for pat_len in (1, 5, 9, 17, 40):
+        for start in (0, 3, 101, len(bits) - pat_len):
+            pattern = bits[start:start + pat_len]
+            naive = [i for i in range(len(bits) - pat_len + 1) if bits[i:i + pat_len] == pattern]
+            assert BitPattern(pattern).find(binary) == naive
+
+unit_test_find()
+
+def find_approx(binary, bits, k):
+    """(distance, bit offset) of every offset within k bit errors of bits, closest first
+
+    Bit-parallel over the whole input at once: each of the pattern's bits gives a vector of
+    mismatches at every offset (the input shifted by that bit, xor the bit), and these are summed
+    into per-offset counters kept as bit planes in big ints, saturating above k. The work is a
+    few big int operations per pattern bit, regardless of how many errors are allowed.
+    """
+    nbits = 8 * len(binary)
+    pat_len = len(bits)
+    if pat_len == 0 or pat_len > nbits:
+        return []
+    everything = (1 << nbits) - 1
+    stream = int.from_bytes(binary, 'big')
+    # offset p (counted from the first, most significant, bit) is bit nbits - 1 - p in these
+    nplanes = max(k.bit_length(), 1)
+    planes = [0] * nplanes
+    overflow = 0
+    for (j, b) in enumerate(bits):
+        # input bit p + j lines up at offset p
+        mismatch = (stream << j) & everything
+        if b:
+            mismatch ^= everything
+        carry = mismatch
+        for plane in range(nplanes):
+            (planes[plane], carry) = (planes[plane] ^ carry, planes[plane] & carry)
+        overflow |= carry
+
+    # counter <= k, compared plane by plane from the most significant one
+    below = 0
+    equal = everything
+    for plane in reversed(range(nplanes)):
+        if (k >> plane) & 1:
+            below |= equal & ~planes[plane]
+            equal &= planes[plane]
+        else:
+            equal &= ~planes[plane]
+    # offsets that have the whole pattern inside the input
+    valid = everything ^ ((1 << (pat_len - 1)) - 1)
+    close = (below | equal) & ~overflow & valid
+
+    hits = []
+    while close:
+        low = close & -close
+        bit = low.bit_length() - 1
+        close ^= low
+        distance = sum(((planes[plane] >> bit) & 1) << plane for plane in range(nplanes))
+        hits.append((distance, nbits - 1 - bit))
+    hits.sort()
+    return hits
+
+def unit_test_find_approx():
+    from random import Random
+    rng = Random(2)
+    binary = bytes(rng.getrandbits(8) for _ in range(48))
+    bits = list(expand_bits_msb(binary))
+    for (pat_len, k) in ((1, 0), (12, 2), (20, 5), (33, 3)):
+        pattern = bits[17:17 + pat_len]
+        # flip a couple of bits
+        pattern[0] ^= 1
+        pattern[-1] ^= 1
+        naive = []
+        for i in range(len(bits) - pat_len + 1):
+            distance = sum(a != b for (a, b) in zip(bits[i:i + pat_len], pattern))
+            if distance <= k:
+                naive.append((distance, i))
+        assert find_approx(binary, pattern, k) == sorted(naive)
+
+unit_test_find_approx()
+
+# transcribed from a photo of the panel showing a P
+PART_OF_P_PATTERNS = [
+    [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 0, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 1, 1, 1, 0, 0, 1, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 1, 0, 0, 0, 0],
+    [0, 1, 1, 1, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+]
 
 def find_part_of_p(filename):
-    bit_patterns = [
-        [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 0, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 1, 1, 1, 0, 0, 1, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 1, 0, 0, 0, 0],
-        [0, 1, 1, 1, 0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-    ]
-    binary = open(filename, 'rb').read()
+    bit_patterns = PART_OF_P_PATTERNS
+    # mapped instead of read so that big dumps are paged in as needed
+    binary = map_file(filename)
     for (i, pat) in enumerate(bit_patterns):
         print("%s as is?" % i)
         try_find(binary, pat)
         print("%s reversed?" % i)
         try_find(binary, pat[::-1])
 
+# the variations that the note at the top was lucky enough to not need
+
+def lsb_first(bits):
+    """Bit order flipped within each byte, for data stored lsb first (assumes byte alignment)"""
+    return [b for off in range(0, len(bits), 8) for b in bits[off:off + 8][::-1]]
+
+def padded(bits, group):
+    """Each group of bits zero padded to a byte, for rows stored one per byte"""
+    return [b for off in range(0, len(bits), group) for b in
+            (bits[off:off + group] + [0] * 8)[:8]]
+
+def pattern_variants(bits, pad_group=5):
+    return [
+        ('as is', bits),
+        ('reversed', bits[::-1]),
+        ('lsb first', lsb_first(bits)),
+        ('inverted', [1 - b for b in bits]),
+        ('padded', padded(bits, pad_group)),
+    ]
+
+class AhoCorasick:
+    """Finds all of many byte strings in one pass over the data"""
+    def __init__(self, needles):
+        self.lengths = [len(needle) for needle in needles]
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for (i, needle) in enumerate(needles):
+            state = 0
+            for byte in needle:
+                if byte not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][byte] = len(self.goto) - 1
+                state = self.goto[state][byte]
+            self.out[state].append(i)
+        # breadth first so that the fail state of a parent is done before its children
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for (byte, child) in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and byte not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(byte, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find_all(self, data, base=0):
+        """(start offset, needle index) of every occurrence, in order of where they end"""
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        lengths = self.lengths
+        state = 0
+        for (i, byte) in enumerate(data):
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            for needle in out[state]:
+                yield (base + i - lengths[needle] + 1, needle)
+
+def masked_values(data, mask, nbytes):
+    """Every nbytes long byte string that has the bits of data where mask is set"""
+    free = [bit for bit in range(8 * nbytes) if not (mask >> bit) & 1]
+    values = []
+    for n in range(1 << len(free)):
+        value = data
+        for (i, bit) in enumerate(free):
+            if (n >> i) & 1:
+                value |= 1 << bit
+        values.append(value.to_bytes(nbytes, 'big'))
+    return values
+
+class MultiScanner:
+    """Many named bit patterns and their variants, all searched for in a single pass
+
+    The byte cores of every pattern, variant and bit alignment (see BitPattern) go in one
+    Aho-Corasick automaton; each core hit is then checked against its whole masked pattern.
+    Alignments too short for a whole byte core span at most 2 bytes, and every byte string they
+    allow is a needle instead, so short patterns don't need a pass of their own either.
+    """
+    def __init__(self, named_patterns, variants=None, pad_group=5):
+        self.targets = []
+        cores = {}
+        for (name, bits) in named_patterns:
+            for (variant, vbits) in pattern_variants(bits, pad_group):
+                if variants is not None and variant not in variants:
+                    continue
+                for alignment in BitPattern(vbits).alignments:
+                    target = (name, variant) + alignment
+                    (shift, data, mask, nbytes, core, core_start) = alignment
+                    if core:
+                        cores.setdefault(core, []).append(target)
+                    elif nbytes > 0:
+                        # core_start is 0, so the needle is found where the match starts
+                        for needle in masked_values(data, mask, nbytes):
+                            cores.setdefault(needle, []).append(target)
+        # bytes spanned by the longest pattern at its worst alignment
+        self.max_bytes = max([target[5] for targets in cores.values() for target in targets] +
+                [1])
+        self.needles = list(cores.keys())
+        self.needle_targets = [cores[needle] for needle in self.needles]
+        self.automaton = AhoCorasick(self.needles)
+
+    def check(self, binary, target, start):
+        (name, variant, shift, data, mask, nbytes, core, core_start) = target
+        if start < 0 or start + nbytes > len(binary):
+            return None
+        window = int.from_bytes(binary[start:start + nbytes], 'big')
+        if window & mask != data:
+            return None
+        return (name, variant, 8 * start + shift, 0)
+
+    def scan(self, binary):
+        """Yield (pattern name, variant, bit offset, distance) for every match as it is found
+
+        The distance is always 0 here; see ApproxScanner.
+        """
+        for (pos, needle) in self.automaton.find_all(binary):
+            for target in self.needle_targets[needle]:
+                hit = self.check(binary, target, pos - target[-1])
+                if hit is not None:
+                    yield hit
+
+class ApproxScanner:
+    """Like MultiScanner, but matches within k bit errors too; one find_approx pass per variant"""
+    def __init__(self, named_patterns, variants=None, pad_group=5, k=1):
+        self.k = k
+        self.targets = []
+        for (name, bits) in named_patterns:
+            for (variant, vbits) in pattern_variants(bits, pad_group):
+                if variants is None or variant in variants:
+                    self.targets.append((name, variant, vbits))
+        self.max_bytes = max([(len(vbits) + 14) // 8 for (_, _, vbits) in self.targets] + [1])
+
+    def scan(self, binary):
+        for (name, variant, vbits) in self.targets:
+            for (distance, offset) in find_approx(binary, vbits, self.k):
+                yield (name, variant, offset, distance)
+
+def naive_find(bits, pattern):
+    return [i for i in range(len(bits) - len(pattern) + 1) if bits[i:i + len(pattern)] == pattern]
+
+def unit_test_multi_scan():
+    from random import Random
+    rng = Random(3)
+    patterns = [
+        ('tiny', [1, 0, 1]),
+        ('short', [rng.getrandbits(1) for _ in range(6)]),
+        ('ten', [rng.getrandbits(1) for _ in range(10)]),
+        ('medium', [rng.getrandbits(1) for _ in range(15)]),
+        ('long', [rng.getrandbits(1) for _ in range(27)]),
+    ]
+    bits = [rng.getrandbits(1) for _ in range(8 * 64)]
+    # every variant of every pattern planted somewhere, some overlapping
+    for (name, pattern) in patterns:
+        for (variant, vbits) in pattern_variants(pattern):
+            at = rng.randrange(len(bits) - len(vbits))
+            bits[at:at + len(vbits)] = vbits
+    binary = pack_bits_msb(bits)
+    hits = sorted(MultiScanner(patterns).scan(binary))
+    naive = sorted((name, variant, offset, 0)
+            for (name, pattern) in patterns
+            for (variant, vbits) in pattern_variants(pattern)
+            for offset in naive_find(bits, vbits))
+    assert hits == naive
+
+unit_test_multi_scan()
+
+# files are scanned in chunks this big, plus enough overlap for the longest pattern, so memory use
+# doesn't depend on the file size
+CHUNK_SIZE = 1 << 20
+
+def map_file(filename):
+    f = open(filename, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        f.close()
+        return b''
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    return mm
+
+def file_chunks(filename, chunk_size=CHUNK_SIZE):
+    """(filename, start, length) of each chunk of a file"""
+    size = os.path.getsize(filename)
+    return [(filename, start, min(chunk_size, size - start))
+            for start in range(0, size, chunk_size)]
+
+def scan_chunk(scanner, binary, start, length):
+    """Hits with absolute bit offsets for matches that start within [start, start + length)
+
+    The chunk is read with an overlap of the longest pattern so matches across the end aren't lost;
+    the ones that start in the overlap belong to the next chunk.
+    """
+    data = binary[start:start + length + scanner.max_bytes - 1]
+    hits = []
+    for (name, variant, offset, distance) in scanner.scan(data):
+        if offset // 8 < length:
+            hits.append((name, variant, 8 * start + offset, distance))
+    return hits
+
+def unit_test_scan_chunk():
+    from random import Random
+    rng = Random(4)
+    pattern = [rng.getrandbits(1) for _ in range(21)]
+    bits = [rng.getrandbits(1) for _ in range(8 * 50)]
+    # across the boundary of the 7 byte chunks at byte 21, starting mid byte
+    at = 8 * 21 - 11
+    bits[at:at + len(pattern)] = pattern
+    binary = pack_bits_msb(bits)
+    chunk_size = 7
+    for scanner in (MultiScanner([('p', pattern)]), ApproxScanner([('p', pattern)], k=2)):
+        chunked = []
+        for start in range(0, len(binary), chunk_size):
+            chunked += scan_chunk(scanner, binary, start, min(chunk_size, len(binary) - start))
+        assert sorted(chunked) == sorted(scanner.scan(binary))
+        assert ('p', 'as is', at, 0) in chunked
+
+unit_test_scan_chunk()
+
+# the pool workers each build their own scanner once
+_scanner = None
+
+def _init_worker(named_patterns, variants, pad_group, k):
+    global _scanner
+    if k == 0:
+        _scanner = MultiScanner(named_patterns, variants, pad_group)
+    else:
+        _scanner = ApproxScanner(named_patterns, variants, pad_group, k)
+
+def _scan_file_chunk(task):
+    (filename, start, length) = task
+    binary = map_file(filename)
+    try:
+        return (filename, start, length, scan_chunk(_scanner, binary, start, length))
+    finally:
+        if isinstance(binary, mmap.mmap):
+            binary.close()
+
+def scan_files(filenames, named_patterns, variants=None, pad_group=5, processes=None,
+        chunk_size=CHUNK_SIZE, k=0):
+    """Scan files in parallel a chunk at a time, allowing k bit errors per match
+
+    Yields (filename, chunk start, chunk length, hits) as soon as each chunk is done, in no
+    particular order.
+    """
+    tasks = [task for filename in filenames for task in file_chunks(filename, chunk_size)]
+    with Pool(processes, _init_worker, (named_patterns, variants, pad_group, k)) as pool:
+        for result in pool.imap_unordered(_scan_file_chunk, tasks):
+            yield result
+
+def load_patterns(filename):
+    """Lines of "name 0110..."; blank lines and # comments skipped"""
+    patterns = []
+    for line in open(filename):
+        line = line.split('#')[0].split()
+        if line:
+            patterns.append((line[0], [int(b) for b in ''.join(line[1:])]))
+    return patterns
+
+def scan_main(args):
+    parser = ArgumentParser(prog='binpatterns.py scan',
+            description='Search many bit patterns and their variants in many files')
+    parser.add_argument('-p', '--patterns',
+            help='file of "name 0110..." lines; the part of P by default')
+    parser.add_argument('-v', '--variant', action='append', dest='variants',
+            choices=[v for (v, _) in pattern_variants([])],
+            help='only this variant, can be given many times; all by default')
+    parser.add_argument('--pad', type=int, default=5,
+            help='bits per group for the padded variant')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('-k', '--errors', type=int, default=0,
+            help='also report matches with up to this many wrong bits, closest first')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE,
+            help='bytes per chunk; memory use scales with this, not the file size')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(args)
+
+    if args.patterns is not None:
+        patterns = load_patterns(args.patterns)
+    else:
+        patterns = [(str(i), bits) for (i, bits) in enumerate(PART_OF_P_PATTERNS)]
+
+    sizes = {filename: os.path.getsize(filename) for filename in args.files}
+    done = {filename: 0 for filename in args.files}
+    results = scan_files(args.files, patterns, args.variants, args.pad, args.jobs, args.chunk,
+            args.errors)
+    # approximate hits are ranked by distance over the whole file, so held back until the end
+    ranked = []
+    for (filename, start, length, hits) in results:
+        if args.errors > 0:
+            ranked += [(filename,) + hit for hit in hits]
+        else:
+            for (name, variant, offset, distance) in sorted(hits, key=lambda hit: hit[2]):
+                print("%s: %s %s, bits: %s, bytes: %s" % (filename, name, variant, offset,
+                    offset / 8.0), flush=True)
+        done[filename] += length
+        # progress only for files that take a while
+        if sizes[filename] > 4 * args.chunk:
+            print("%s: %.1f/%.1f MiB scanned" % (filename, done[filename] / 2**20,
+                sizes[filename] / 2**20), file=stderr, flush=True)
+
+    for (filename, name, variant, offset, distance) in sorted(ranked,
+            key=lambda hit: (hit[4], hit[0], hit[3])):
+        print("%s: %s %s, bits: %s, bytes: %s, distance: %s" % (filename, name, variant, offset,
+            offset / 8.0, distance))
 
 def main(binfilename):
     find_part_of_p(binfilename)
 
 if __name__ == "__main__":
-    main(*argv[1:])
+    if len(argv) >= 2 and argv[1] == 'scan':
+        scan_main(argv[2:])
+    else:
+        main(*argv[1:])
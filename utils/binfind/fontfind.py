@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import os
+from itertools import accumulate
+import sys
+from sys import argv
+from time import perf_counter
+from binpatterns import map_file
+
+# the pad bit layout lives with the panel driver
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pixel_map'))
+from pad_bits import PAD_BITS_FILE, load_pad_bits
+
+# Locates the glyph table in a firmware image. Every candidate base offset and glyph stride is
+# scored at once per stride and byte column (see score_pads), and the best ones are then checked
+# for plausible glyph shapes.
+
+GLYPHS = 256
+# 120 bits per glyph, same layout as one digit's data on the wire
+GLYPH_BYTES = 15
+# packed back to back, or with a byte of padding per glyph
+STRIDES = (15, 16)
+
+# below this it's more likely that there's no font of this format at all
+MIN_SCORE = 1.5
+
+# ascii codes that should look like something, and the one that shouldn't
+DIGIT_GLYPHS = range(ord('0'), ord('9') + 1)
+SPACE_GLYPH = ord(' ')
+
+def glyph_pad_mask(filename=PAD_BITS_FILE):
+    """The pad bits of a glyph (or any one digit), as a mask per glyph byte"""
+    # a panel is 4 * 80 upper bits, right to left, then 4 * 40 lower bits, left to right; take the
+    # leftmost digit, it's the same for all of them
+    upper = range(3 * 80, 4 * 80)
+    lower = range(4 * 80, 4 * 80 + 40)
+    digit_bits = list(upper) + list(lower)
+    mask = bytearray(GLYPH_BYTES)
+    for bit in load_pad_bits(filename):
+        if bit in digit_bits:
+            i = digit_bits.index(bit)
+            mask[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(mask)
+
+def window_sums(flags, width):
+    """Sums of each run of width consecutive flags, one per start index"""
+    prefix = [0] + list(accumulate(flags))
+    return [b - a for (a, b) in zip(prefix, prefix[width:])]
+
+def score_pads(binary, stride, pad_mask):
+    """[base] -> how many glyph bytes with pad bits at base, base + stride, ... have one set
+
+    For each byte column of the glyph with pad bits, the bytes of every residue class modulo the
+    stride are taken with one strided slice and masked with translate(), so the only per-offset
+    Python work is a sliding window sum.
+    """
+    nbases = len(binary) - (GLYPHS - 1) * stride - GLYPH_BYTES + 1
+    if nbases <= 0:
+        return []
+    bad = [0] * nbases
+    for (col, mask) in enumerate(pad_mask):
+        if mask == 0:
+            continue
+        # nonzero where a pad bit is set
+        table = bytes(1 if b & mask else 0 for b in range(256))
+        for residue in range(stride):
+            start = residue + col
+            column = binary[start::stride].translate(table)
+            sums = window_sums(column, GLYPHS)
+            # base = residue + stride * q sees this column's glyphs from index q on
+            for (q, n) in enumerate(sums):
+                base = residue + stride * q
+                if base >= nbases:
+                    break
+                bad[base] += n
+    return bad
+
+def glyph(binary, base, stride, code):
+    off = base + code * stride
+    return binary[off:off + GLYPH_BYTES]
+
+def popcount(data):
+    return bin(int.from_bytes(data, 'big')).count('1')
+
+def shape_score(binary, base, stride):
+    """0..1 for how much the space and digit glyphs look like a font"""
+    score = 0.0
+    if not any(glyph(binary, base, stride, SPACE_GLYPH)):
+        score += 0.5
+    digits = [glyph(binary, base, stride, code) for code in DIGIT_GLYPHS]
+    # digits are all different, and neither blank nor mostly lit
+    if len(set(digits)) == len(digits):
+        score += 0.25
+    inked = [10 <= popcount(data) <= 80 for data in digits]
+    score += 0.25 * sum(inked) / len(inked)
+    return score
+
+def locate_font(binary, strides=STRIDES, shortlist=32, pad_mask=None):
+    """Candidate (score, base, stride) locations of the glyph table, best first
+
+    A perfect score is 2.0: no pad bits set in any glyph, and plausible looking glyphs.
+    """
+    if pad_mask is None:
+        pad_mask = glyph_pad_mask()
+    candidates = []
+    for stride in strides:
+        bad = score_pads(binary, stride, pad_mask)
+        # only the cleanest offsets are worth looking at closer
+        best = sorted(range(len(bad)), key=lambda base: bad[base])[:shortlist]
+        pad_bytes = GLYPHS * sum(1 for mask in pad_mask if mask != 0)
+        for base in best:
+            pad_score = 1.0 - bad[base] / float(pad_bytes)
+            candidates.append((pad_score + shape_score(binary, base, stride), base, stride))
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+    return candidates
+
+def find_font(filename):
+    """(base, stride) of the most likely glyph table in a firmware image file"""
+    binary = bytes(map_file(filename))
+    candidates = locate_font(binary)
+    if not candidates or candidates[0][0] < MIN_SCORE:
+        raise ValueError("no font found in %s" % filename)
+    (score, base, stride) = candidates[0]
+    return (base, stride)
+
+def main(*filenames):
+    for filename in filenames:
+        binary = bytes(map_file(filename))
+        a = perf_counter()
+        candidates = locate_font(binary)
+        d = perf_counter() - a
+        print("%s (%.3f s):" % (filename, d))
+        for (score, base, stride) in candidates[:5]:
+            print("  base 0x%x, stride %d, score %.3f" % (base, stride, score))
+
+if __name__ == "__main__":
+    main(*argv[1:])
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import os
+import struct
+import tempfile
+from sys import argv
+from time import sleep, monotonic
+import pixel_map
+
+# Recording of blitted frames to a file, and playing them back on the original timing.
+#
+# File format, all little endian:
+#   header:  magic "LKNREC1\0", u16 panels
+#   records: f64 seconds since the first frame, u8 kind, u32 payload length, payload
+#            kind KEYFRAME: the whole frame, 60 bytes per panel, packed like on the wire
+#            kind DELTA: runs of u16 bytes to skip, u16 run length, then that many new bytes,
+#            against the previous frame
+#   index:   u32 count, then f64 time and u64 file offset of every keyframe
+#   footer:  u64 file offset of the index, magic "LKNIDX1\0"
+# The index is written on close; a file without one (say, the recorder crashed) still plays from
+# the start, it just can't seek.
+
+MAGIC = b'LKNREC1\0'
+INDEX_MAGIC = b'LKNIDX1\0'
+HEADER = struct.Struct('<8sH')
+RECORD = struct.Struct('<dBI')
+RUN = struct.Struct('<HH')
+INDEX_ENTRY = struct.Struct('<dQ')
+FOOTER = struct.Struct('<Q8s')
+
+KEYFRAME = 0
+DELTA = 1
+
+def encode_delta(prev, frame):
+    """Runs of changed bytes of frame against prev; close runs are merged to save headers"""
+    out = bytearray()
+    n = len(frame)
+    pos = 0
+    last_end = 0
+    while pos < n:
+        if frame[pos] == prev[pos]:
+            pos += 1
+            continue
+        start = pos
+        end = pos + 1
+        # bridge gaps shorter than a run header
+        while end < n and end - start < 0xffff:
+            if frame[end] != prev[end]:
+                end += 1
+            elif frame[end:end + RUN.size] != prev[end:end + RUN.size] and end + 1 < n:
+                end += 1
+            else:
+                break
+        out += RUN.pack(start - last_end, end - start)
+        out += frame[start:end]
+        last_end = end
+        pos = end
+    return bytes(out)
+
+def apply_delta(frame, payload):
+    pos = 0
+    off = 0
+    while off < len(payload):
+        (skip, length) = RUN.unpack_from(payload, off)
+        off += RUN.size
+        pos += skip
+        frame[pos:pos + length] = payload[off:off + length]
+        off += length
+        pos += length
+
+class FrameRecorder:
+    """Writes frames with their times; keyframe_interval frames between full frames"""
+    def __init__(self, filename, panels, keyframe_interval=100):
+        self.f = open(filename, 'wb')
+        self.panels = panels
+        self.keyframe_interval = keyframe_interval
+        self.f.write(HEADER.pack(MAGIC, panels))
+        self.prev = None
+        self.since_keyframe = 0
+        self.t0 = None
+        self.index = []
+        self.frames = 0
+
+    def record(self, frame, t=None):
+        if t is None:
+            t = monotonic()
+        if self.t0 is None:
+            self.t0 = t
+        ts = t - self.t0
+        frame = bytes(frame)
+        assert len(frame) == self.panels * pixel_map.BYTES
+        if frame == self.prev:
+            # the panel keeps showing it anyway
+            return
+        if self.prev is None or self.since_keyframe >= self.keyframe_interval:
+            self.index.append((ts, self.f.tell()))
+            self.write_record(ts, KEYFRAME, frame)
+            self.since_keyframe = 0
+        else:
+            self.write_record(ts, DELTA, encode_delta(self.prev, frame))
+            self.since_keyframe += 1
+        self.prev = frame
+        self.frames += 1
+
+    def write_record(self, ts, kind, payload):
+        self.f.write(RECORD.pack(ts, kind, len(payload)))
+        self.f.write(payload)
+
+    def close(self):
+        index_offset = self.f.tell()
+        self.f.write(struct.pack('<I', len(self.index)))
+        for (ts, offset) in self.index:
+            self.f.write(INDEX_ENTRY.pack(ts, offset))
+        self.f.write(FOOTER.pack(index_offset, INDEX_MAGIC))
+        self.f.close()
+
+class RecordingDisplay:
+    """Wraps a Display (or nothing, to just record) and records everything blitted to it"""
+    def __init__(self, display, filename, panels=None, keyframe_interval=100):
+        self.display = display
+        self.panels = display.panels if panels is None else panels
+        self.recorder = FrameRecorder(filename, self.panels, keyframe_interval)
+
+    def num_digits(self):
+        return self.panels * pixel_map.DIGITS
+
+    def new_window(self):
+        return pixel_map.Window(self.panels)
+
+    def blit(self, window):
+        self.blit_frame(window.frame())
+
+    def blit_frame(self, frame):
+        self.recorder.record(frame)
+        if self.display is not None:
+            self.display.blit_frame(frame)
+
+    def close(self):
+        self.recorder.close()
+        if self.display is not None:
+            self.display.close()
+
+class FramePlayer:
+    """Reads a recording back as (seconds, frame) pairs"""
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        (magic, self.panels) = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a frame recording" % filename)
+        self.frame_bytes = self.panels * pixel_map.BYTES
+        self.index = self.read_index()
+        self.end = self.index_offset
+
+    def read_index(self):
+        self.f.seek(0, 2)
+        size = self.f.tell()
+        self.index_offset = size
+        if size < HEADER.size + FOOTER.size:
+            return []
+        self.f.seek(size - FOOTER.size)
+        (index_offset, magic) = FOOTER.unpack(self.f.read(FOOTER.size))
+        if magic != INDEX_MAGIC:
+            return []
+        self.index_offset = index_offset
+        self.f.seek(index_offset)
+        (count,) = struct.unpack('<I', self.f.read(4))
+        data = self.f.read(count * INDEX_ENTRY.size)
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+    def frames(self, start=0.0):
+        """(seconds, frame) from the last keyframe at or before start on; frame is reused"""
+        offset = HEADER.size
+        for (ts, keyframe_offset) in self.index:
+            if ts > start:
+                break
+            offset = keyframe_offset
+        self.f.seek(offset)
+        frame = bytearray(self.frame_bytes)
+        while self.f.tell() < self.end:
+            header = self.f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # cut short
+                return
+            (ts, kind, length) = RECORD.unpack(header)
+            payload = self.f.read(length)
+            if len(payload) < length:
+                return
+            if kind == KEYFRAME:
+                frame[:] = payload
+            else:
+                apply_delta(frame, payload)
+            if ts >= start:
+                yield (ts, frame)
+
+    def play(self, display, speed=1.0, start=0.0):
+        """Blit the frames to display on their recorded timing"""
+        t0 = None
+        for (ts, frame) in self.frames(start):
+            if t0 is None:
+                t0 = monotonic() - (ts - start) / speed
+            delay = t0 + (ts - start) / speed - monotonic()
+            if delay > 0:
+                sleep(delay)
+            display.blit_frame(frame)
+
+    def close(self):
+        self.f.close()
+
+def unit_test_delta():
+    prev = bytes(60)
+    frame = bytearray(prev)
+    frame[3] = 1
+    frame[5] = 2
+    frame[40:50] = b'x' * 10
+    frame[59] = 7
+    out = bytearray(prev)
+    apply_delta(out, encode_delta(prev, bytes(frame)))
+    assert out == frame
+    assert encode_delta(prev, prev) == b''
+
+unit_test_delta()
+
+def unit_test_roundtrip():
+    frames = []
+    for n in range(10):
+        window = pixel_map.Window(1)
+        window.putpixel(n % pixel_map.DIGITS, n % pixel_map.W, n // pixel_map.DIGITS)
+        frames.append(bytes(window.frame()))
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'test.rec')
+        recorder = FrameRecorder(filename, 1, keyframe_interval=3)
+        for (n, frame) in enumerate(frames):
+            recorder.record(frame, float(n))
+            # unchanged, not recorded
+            recorder.record(frame, n + 0.5)
+        recorder.close()
+
+        player = FramePlayer(filename)
+        assert player.panels == 1
+        assert [ts for (ts, offset) in player.index] == [0.0, 4.0, 8.0]
+        assert [(ts, bytes(frame)) for (ts, frame) in player.frames()] == \
+            [(float(n), frame) for (n, frame) in enumerate(frames)]
+        # from the keyframe at 4, with its deltas applied
+        assert [(ts, bytes(frame)) for (ts, frame) in player.frames(5.5)] == \
+            [(float(n), frames[n]) for n in range(6, 10)]
+        index_offset = player.index_offset
+        player.close()
+
+        # without the index, like after a crash: still plays from the start, and a record cut
+        # short ends it
+        data = open(filename, 'rb').read()
+        for (end, count) in ((index_offset, 10), (index_offset - 10, 9)):
+            with open(filename, 'wb') as f:
+                f.write(data[:end])
+            player = FramePlayer(filename)
+            assert player.index == []
+            assert [bytes(frame) for (ts, frame) in player.frames(2.0)] == frames[2:count]
+            player.close()
+
+unit_test_roundtrip()
+
+def main():
+    # frame_record.py record out.rec ROM panels: run the demos into a file, no hardware needed
+    # frame_record.py play in.rec PORT: play back to a port, or "emu" for a window; ports and an
+    # optional firmware like for pixel_map.py, the recorded panels split evenly between the ports
+    if argv[1] == 'record':
+        font = pixel_map.Font(argv[3])
+        display = RecordingDisplay(None, argv[2], int(argv[4]))
+        try:
+            pixel_map.run_demos(display, font)
+        except KeyboardInterrupt:
+            display.close()
+    elif argv[1] == 'play':
+        player = FramePlayer(argv[2])
+        nports = len(argv[3].split(','))
+        if player.panels % nports != 0:
+            raise SystemExit("%d panels can't be split over %d ports" % (player.panels, nports))
+        firmware = argv[4] if len(argv) >= 5 else 'ino'
+        display = pixel_map.open_display(argv[3], player.panels // nports, firmware)
+        player.play(display)
+        display.close()
+
+if __name__ == "__main__":
+    main()
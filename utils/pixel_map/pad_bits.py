@@ -0,0 +1,24 @@
+import os
+
+# The pad bits of a panel, from docs/lcd_panel/pad_bits.txt. Shared by pixel_map, which masks
+# them off every frame, and binfind/fontfind, which uses them to spot the glyph table; kept out of
+# pixel_map so that fontfind doesn't need serial.
+
+PAD_BITS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        '..', '..', 'docs', 'lcd_panel', 'pad_bits.txt')
+
+def load_pad_bits(filename=PAD_BITS_FILE):
+    """Panel bits that are padding, as wire bit indices (0 is the first one sent)
+
+    The file lists the shift register from its far end, lsb first within each byte, so both the
+    bit order and the byte order are the reverse of what is sent.
+    """
+    values = []
+    for line in open(filename):
+        line = line.split('//')[0].strip()
+        if line.startswith('0b'):
+            values.append(int(line, 2))
+    nbits = 8 * len(values)
+    return [nbits - 1 - (8 * i + j)
+            for (i, value) in enumerate(values)
+            for j in range(8) if value & (1 << j)]
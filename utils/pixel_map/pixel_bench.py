@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import json
+import subprocess
+from sys import argv
+from time import perf_counter
+import pixel_map
+import proxy_emu
+try:
+    # optional, only for the canvas numbers
+    import pixel_canvas
+except ImportError:
+    pixel_canvas = None
+
+# Benchmarks for the host side hot paths, runnable without hardware: rendering, packing, and
+# blitting to an emulated proxy, the wire ones with the uart speed and an ack roundtrip emulated.
+# Results can be saved as json and compared against an earlier run.
+
+PANEL_COUNTS = [1, 2, 4, 8, 16, 32]
+# the proxy.ino default in pixel_map.main
+BAUD = 115200
+# per measurement
+MIN_TIME = 0.2
+# ack roundtrip over usb, give or take
+LATENCY = 0.002
+
+def measure(fn, min_time=MIN_TIME):
+    """Calls of fn per second, running it in growing batches for at least min_time"""
+    n = 1
+    while True:
+        a = perf_counter()
+        for _ in range(n):
+            fn()
+        d = perf_counter() - a
+        if d >= min_time:
+            return n / d
+        n *= 2
+
+def alternating_frames(panels):
+    """Two different windows so that no blit is skipped as unchanged"""
+    lit = pixel_map.Window(panels)
+    lit.fill()
+    return [pixel_map.Window(panels), lit]
+
+def bench_blit(panels, baud=None, latency=0.0, in_flight=None):
+    emu = proxy_emu.ProxyEmulator(panels)
+    port = proxy_emu.FakeSerial(emu, baud, latency=latency)
+    port.read(9999999)
+    display = pixel_map.Display(port, panels, in_flight=in_flight)
+    windows = alternating_frames(panels)
+    state = [0]
+    def blit():
+        state[0] ^= 1
+        display.blit(windows[state[0]])
+    return measure(blit)
+
+def bench_panels(font, panels):
+    window = pixel_map.Window(panels)
+    text = ('Longtext' * panels)[:window.num_digits()]
+    bits = window.pixels
+    packed = bytes(window.buf)
+    frame_bytes = panels * pixel_map.BYTES
+    wire_fps = BAUD / 10.0 / frame_bytes
+
+    def putpixel():
+        window.putpixel(0, 2, 3)
+    def fill():
+        window.fill()
+    def render():
+        font.render(window, text)
+    def pack():
+        bytes(pixel_map.bitstring_to_bytestring_be(bits))
+    def expand():
+        list(pixel_map.expand_bits_be(packed))
+
+    blit_wire_fps = bench_blit(panels, BAUD, LATENCY)
+    results = {
+        'putpixel_ops': measure(putpixel),
+        'fill_ops': measure(fill),
+        'render_ops': measure(render),
+        'pack_ops': measure(pack),
+        'expand_ops': measure(expand),
+        'blit_fps': bench_blit(panels),
+        'blit_wire_fps': blit_wire_fps,
+        'blit_wire_unpipelined_fps': bench_blit(panels, BAUD, LATENCY, in_flight=1),
+        'wire_fps': wire_fps,
+        'wire_fraction': blit_wire_fps / wire_fps,
+    }
+    if pixel_canvas is not None:
+        canvas = pixel_canvas.Canvas(panels)
+        canvas.array[::2, ::3] = True
+        results['canvas_pack_ops'] = measure(canvas.frame)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(font, panel_counts=PANEL_COUNTS):
+    results = {'revision': git_revision(), 'baud': BAUD, 'panels': {}}
+    for panels in panel_counts:
+        results['panels'][str(panels)] = bench_panels(font, panels)
+    return results
+
+def print_results(results, baseline=None):
+    keys = list(next(iter(results['panels'].values())).keys())
+    width = max(map(len, keys))
+    print("revision %s, baud %d" % (results['revision'], results['baud']))
+    for (panels, r) in results['panels'].items():
+        print("%s panels:" % panels)
+        for key in keys:
+            line = "  %-*s %14.2f" % (width, key, r[key])
+            if baseline is not None and panels in baseline['panels']:
+                old = baseline['panels'][panels].get(key)
+                if old:
+                    line += "  %6.2fx vs %s" % (r[key] / old, baseline['revision'])
+            print(line)
+
+def main():
+    # usage: pixel_bench.py rom [results.json [baseline.json]]
+    font = pixel_map.Font(argv[1])
+    results = run(font)
+    baseline = None
+    if len(argv) >= 4:
+        baseline = json.load(open(argv[3]))
+    print_results(results, baseline)
+    if len(argv) >= 3:
+        json.dump(results, open(argv[2], 'w'), indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+from functools import lru_cache
+from sys import argv
+import numpy as np
+import pixel_map
+from pixel_map import W, H, BITS, DIGITS
+
+# A NumPy pixel canvas over the whole chain, for images and full frame effects. Drawing is plain
+# array work, and packing to the wire is one gather and np.packbits instead of a putpixel per
+# pixel. Only this module needs numpy; pixel_map works without it.
+
+@lru_cache(maxsize=None)
+def gather_index(npanels):
+    """[wire bit] -> flat index of the canvas cell that drives it
+
+    Bits that are not part of any pixel point one past the canvas, at a cell that is always off.
+    """
+    ncols = npanels * DIGITS * W
+    ncells = (1 + H) * ncols
+    index = np.full(npanels * BITS, ncells, dtype=np.intp)
+    for (digit, pixels) in enumerate(pixel_map.pixel_index(npanels)):
+        for (i, bits) in enumerate(pixels):
+            # PIXEL_MAP starts with the top row
+            (row, x) = divmod(i, W)
+            cell = row * ncols + digit * W + x
+            for bit in bits:
+                index[bit] = cell
+    return index
+
+class Canvas:
+    """Pixels of a chain of panels as a bool array; use like a pixel_map.Window
+
+    pixels is the H x (W * digits) grid that putpixel draws in and top is the top row above it;
+    both are views into array, which is (1 + H) x (W * digits) with the top row first.
+    """
+    def __init__(self, panels=1):
+        self.panels = panels
+        ncols = panels * DIGITS * W
+        # the extra cell at the end stays off, see gather_index
+        self.cells = np.zeros((1 + H) * ncols + 1, dtype=bool)
+        self.array = self.cells[:-1].reshape(1 + H, ncols)
+        self.top = self.array[0]
+        self.pixels = self.array[1:]
+        self.index = gather_index(panels)
+
+    def num_digits(self):
+        return self.panels * DIGITS
+
+    def clear(self):
+        self.array[...] = False
+
+    def frame(self):
+        """Packed msb first in wire order, the same as Window.frame"""
+        return memoryview(np.packbits(self.cells[self.index]))
+
+    def to_window(self, window):
+        window.buf[:] = self.frame()
+
+    def load(self, window):
+        """Take the pixels of a window; a pixel is on if any of its segments is"""
+        bits = np.unpackbits(np.frombuffer(window.buf, dtype=np.uint8))
+        self.cells[...] = False
+        np.logical_or.at(self.cells, self.index, bits.astype(bool))
+        self.cells[-1] = False
+
+def unit_test_canvas():
+    for panels in (1, 2):
+        canvas = Canvas(panels)
+        window = pixel_map.Window(panels)
+        # a diagonal in every digit, plus some of the top row
+        for digit in range(canvas.num_digits()):
+            for y in range(H):
+                x = (y + digit) % W
+                canvas.pixels[y, digit * W + x] = True
+                window.putpixel(digit, x, y)
+            canvas.top[digit * W] = True
+            window.putpixel(digit, 0, -1)
+        assert bytes(canvas.frame()) == bytes(window.buf)
+        loaded = Canvas(panels)
+        loaded.load(window)
+        # not array equality, as a couple of grid spots have no segments at all
+        assert bytes(loaded.frame()) == bytes(window.buf)
+        canvas.array[...] = True
+        window.fill()
+        assert bytes(canvas.frame()) == bytes(window.buf)
+
+unit_test_canvas()
+
+def wavedemo(display, seconds=10.0, fps=30):
+    """A sine wave and a moving gradient across the whole chain"""
+    canvas = Canvas(display.panels)
+    ncols = canvas.pixels.shape[1]
+    x = np.arange(ncols)
+    y = np.arange(H)[:, None]
+    # ordered dither thresholds for the gradient
+    threshold = ((x % 2) * 2 + (y % 2) + 0.5) / 4.0
+    def frames():
+        for n in range(int(seconds * fps)):
+            t = n / float(fps)
+            phase = (x / 12.0 + t) % 1.0
+            canvas.pixels[...] = phase[None, :] > threshold
+            wave = np.round((H - 1) / 2.0 * (1 + np.sin(x / 5.0 - 3 * t))).astype(int)
+            canvas.pixels[wave, x] ^= True
+            canvas.top[...] = (x + n) % 8 == 0
+            yield canvas
+    return [pixel_map.FrameScheduler(fps).play(display, frames())]
+
+def main():
+    # usage: pixel_canvas.py PORT panels; the port works like for pixel_map.py
+    display = pixel_map.open_display(argv[1], int(argv[2]))
+    while True:
+        for stats in wavedemo(display):
+            pixel_map.print_stats('wavedemo', stats)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
+import os
 import sys
 import pygame
 import pygame.gfxdraw
 import pixel_map
-from time import sleep
+from collections import OrderedDict
+from argparse import ArgumentParser
+from multiprocessing import Pool
 
 # FIXME: any off-by-ones?
 
@@ -395,56 +398,103 @@ def run_pure_program(prog):
         stack = x()(stack)
     return stack
 
+def draw_polygon(screen, x, y, poly, scale=SCALE, color=COLOR_SEG, border=COLOR_SEG_BORDER):
+    """Render one polygon with its top left corner at (x, y)"""
+    points = [(scale*(x + px), scale*(y + py)) for (px, py) in poly]
+    pygame.gfxdraw.filled_polygon(screen, points, color)
+    pygame.gfxdraw.aapolygon(screen, points, border)
+
 def emit_polygon(screen, x, y, j, polygons):
     """Render a segment in an area specified in PIXEL_MAP"""
     poly = polygons[j]
     if len(poly) != 0:
-        points = [(SCALE*(x + px), SCALE*(y + py)) for (px, py) in poly]
-        pygame.gfxdraw.filled_polygon(screen, points, COLOR_SEG)
-        pygame.gfxdraw.aapolygon(screen, points, COLOR_SEG_BORDER)
-
-def run_toprow(screen, base_x, base_y, x, j):
-    """Emit top row segment"""
-    # j is always 0 here, and TOP_POLYS is indexed by x, not j
-    emit_polygon(screen, base_x, base_y, x, TOP_POLYS)
-
-def run_render_program(screen, base_x, base_y, x, y, j, prog):
-    """Emit bottom row segment from a program generating its box"""
-    xoffs = [0, fw, fw+hw, fw+hw+fw, fw+hw+fw+hw]
-    x = xoffs[x] + x * pad
-    y *= h + pad
-    polygons = run_pure_program(prog)
-    emit_polygon(screen, x + base_x, dots_yminus + y + base_y, j, polygons)
-
-def render(screen, base_x, base_y, glyphdata):
-    """Render a glyph to screen at (base_x, base_y)"""
-    # note: some are padding bits and are left as None
-    pixel_invmap = [None] * pixel_map.TOTAL_DIGIT_BITS
+        draw_polygon(screen, x, y, poly)
+
+# where each box of the normal region starts horizontally
+XOFFS = [0, fw, fw+hw, fw+hw+fw, fw+hw+fw+hw]
+
+def box_origin(x, y):
+    """Top left of the box for normal region pixel (x, y), relative to the glyph"""
+    return (XOFFS[x] + x * pad, dots_yminus + y * (h + pad))
+
+def compile_segment_polys():
+    """Run all the render programs once: [segment bit in glyph data] -> polygon or None
+
+    The polygons are already offset to their place relative to the top left of the glyph. Pad
+    bits are None and segments that draw nothing (like g1) have an empty polygon.
+    """
+    polys = [None] * pixel_map.TOTAL_DIGIT_BITS
     for (i, pixel) in enumerate(pixel_map.PIXEL_MAP):
         x = i % pixel_map.W
         y = i // pixel_map.W
-        for (j, seg_spec) in enumerate(pixel):
-            offset_in_digit = pixel_map.BITS_PER_LABEL * seg_spec[0] + seg_spec[1]
-            segment = pixel_map.TOTAL_DIGIT_BITS - 1 - offset_in_digit
-            pixel_invmap[segment] = (x, y, j)
-
-    # TODO precompute the above and prerender these
-    for (i, (bit, inv)) in enumerate(zip(glyphdata, pixel_invmap)):
-        if not bit:
-            continue
-        (x, y, j) = inv
-
-        # just double check
-        seg_spec = pixel_map.PIXEL_MAP[pixel_map.W * y + x][j]
-        offset_in_digit = pixel_map.BITS_PER_LABEL * seg_spec[0] + seg_spec[1]
-        segment = pixel_map.TOTAL_DIGIT_BITS - 1 - offset_in_digit
-        assert segment == i
-
         if y == 0:
-            run_toprow(screen, base_x, base_y, x, j)
+            # top row is special; TOP_POLYS is indexed by x and has no offset
+            polygons = [TOP_POLYS[x]]
+            (ox, oy) = (0, 0)
         else:
-            render_program = GFX_PROGRAMS[(y - 1) * pixel_map.W + x]
-            run_render_program(screen, base_x, base_y, x, y - 1, j, render_program)
+            polygons = run_pure_program(GFX_PROGRAMS[(y - 1) * pixel_map.W + x])
+            (ox, oy) = box_origin(x, y - 1)
+        for (j, seg_spec) in enumerate(pixel):
+            segment = pixel_map.spec_segment(seg_spec)
+            assert polys[segment] is None
+            polys[segment] = [(ox + px, oy + py) for (px, py) in polygons[j]]
+    return polys
+
+SEGMENT_POLYS = compile_segment_polys()
+
+def render(screen, base_x, base_y, glyphdata, scale=SCALE, color=COLOR_SEG,
+        border=COLOR_SEG_BORDER):
+    """Render a glyph to screen at (base_x, base_y)"""
+    for (bit, poly) in zip(glyphdata, SEGMENT_POLYS):
+        # pad bits have no polygon
+        if bit and poly:
+            draw_polygon(screen, base_x, base_y, poly, scale, color, border)
+
+class GlyphAtlas:
+    """Glyphs rasterized once onto their own small surfaces, then just blitted
+
+    Surfaces are transparent around the segments and keyed by the packed glyph data, scale and
+    colors; the least recently used ones are dropped beyond maxsize.
+
+    Not pixel exact with render: glyphs land on whole pixels, and the antialiased borders are
+    drawn onto transparency instead of the background, so edges blend a little differently.
+    """
+    def __init__(self, scale=SCALE, color=COLOR_SEG, border=COLOR_SEG_BORDER, maxsize=1024):
+        self.scale = scale
+        self.color = color
+        self.border = border
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, glyphdata, scale=None, color=None, border=None):
+        """Surface for packed glyph data, with the glyph's top left at (0, 0)"""
+        scale = self.scale if scale is None else scale
+        color = self.color if color is None else color
+        border = self.border if border is None else border
+        key = (bytes(glyphdata), scale, color, border)
+        surface = self.cache.get(key)
+        if surface is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        # +2 for the antialiased edges
+        size = (int(scale * totw) + 2, int(scale * toth) + 2)
+        surface = pygame.Surface(size, pygame.SRCALPHA)
+        bits = list(pixel_map.expand_bits_be(glyphdata))
+        render(surface, 0, 0, bits, scale, color, border)
+        self.cache[key] = surface
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return surface
+
+    def blit(self, screen, x, y, glyphdata, scale=None, color=None, border=None):
+        """Like render, but from the cache"""
+        scale = self.scale if scale is None else scale
+        surface = self.get(glyphdata, scale, color, border)
+        screen.blit(surface, (round(scale * x), round(scale * y)))
 
 def flatten_once(lst):
     """[[a, b], [c, d]] -> [a, b, c, d]"""
@@ -464,7 +514,7 @@ def testglyph():
         data[-1 - (8 * a + b)] = 1
     return data
 
-def render_glyph(screen, x, y, font, glyph):
+def render_glyph(screen, x, y, font, glyph, atlas=None):
     """Render a glyph code from a font to screen, top left at (x, y)"""
     # special g variation histogram:
     #   2    g2    g4 g5 = bottom left arc (s, ŝ)
@@ -473,7 +523,14 @@ def render_glyph(screen, x, y, font, glyph):
     # 111 g1 g2 g3 g4 g5 = all set
     # 127                = nothing set
     # note: g3 == g1 && g2 && g4
-    glyphdata = font.get_glyph_data(glyph)
+    if render_test_glyph:
+        render(screen, x, y, testglyph())
+        return
+    if atlas is not None:
+        # straight from the packed data, nothing to expand
+        atlas.blit(screen, x, y, font.get_glyph_data(glyph))
+        return
+    glyphdata = list(pixel_map.expand_bits_be(font.get_glyph_data(glyph)))
     (a, b, c, d, e, f, g, h, i, j, k, l, m, n, o) = range(15)
     g1 = 120 - 1 - (8*g+1)
     g2 = 120 - 1 - (8*g+2)
@@ -493,21 +550,138 @@ def render_glyph(screen, x, y, font, glyph):
     g4 = 'g4' if g4 else '  '
     g5 = 'g5' if g5 else '  '
     #print(g1,g2,g3,g4,g5)
-    if not render_test_glyph:
-        render(screen, x, y, glyphdata)
-    else:
-        data = testglyph()
-        render(screen, x, y, data)
+    render(screen, x, y, glyphdata)
 
-def render_array(screen, font, glyphs):
-    for (i, glyph) in enumerate(glyphs):
+def render_array(screen, font, glyphs, atlas=None, first=0, top=0):
+    """Render glyphs PER_ROW to a row, starting from glyph index first of a sheet
+
+    top is the y pixel of the sheet at the top of screen, for rendering part of a sheet.
+    """
+    for (i, glyph) in enumerate(glyphs, first):
         x = i % PER_ROW * (totw + DIGIT_GAP_W)
-        y = i // PER_ROW * (toth + DIGIT_GAP_H)
+        y = i // PER_ROW * (toth + DIGIT_GAP_H) - top / SCALE
         if render_regions:
             pygame.gfxdraw.rectangle(screen,
                 pygame.Rect(SCALE*x, SCALE*y, SCALE*totw, SCALE*toth),
                 COLOR_DIGIT_BORDER)
-        render_glyph(screen, x, y, font, glyph)
+        render_glyph(screen, x, y, font, glyph, atlas)
+
+def polygon_rect(x, y, poly, scale):
+    """Screen area touched by draw_polygon, antialiasing included"""
+    xs = [scale * (x + px) for (px, _) in poly]
+    ys = [scale * (y + py) for (_, py) in poly]
+    left = int(min(xs)) - 1
+    top = int(min(ys)) - 1
+    return pygame.Rect(left, top, int(max(xs)) + 3 - left, int(max(ys)) + 3 - top)
+
+def segment_neighbors(margin):
+    """[segment bit in glyph data] -> other segments within margin of it, in glyph units"""
+    boxes = [None] * pixel_map.TOTAL_DIGIT_BITS
+    for (segment, poly) in enumerate(SEGMENT_POLYS):
+        if poly:
+            xs = [px for (px, _) in poly]
+            ys = [py for (_, py) in poly]
+            boxes[segment] = (min(xs) - margin, min(ys) - margin, max(xs) + margin,
+                    max(ys) + margin)
+    neighbors = [[] for _ in range(pixel_map.TOTAL_DIGIT_BITS)]
+    for (a, abox) in enumerate(boxes):
+        for (b, bbox) in enumerate(boxes):
+            if a != b and abox is not None and bbox is not None and (abox[0] <= bbox[2] and
+                    bbox[0] <= abox[2] and abox[1] <= bbox[3] and bbox[1] <= abox[3]):
+                neighbors[a].append(b)
+    return neighbors
+
+class EmulatorDisplay:
+    """Stand-in for pixel_map.Display that shows the frames in a window
+
+    Each frame is compared to the previous one and only the segments that changed are drawn; a
+    segment that goes dark has its bounding box cleared, and the lit segments that overlap that box
+    are drawn again. per_row digits go on a row, all of them on one row by default.
+
+    Closing the window raises KeyboardInterrupt from the next blit, so it stops like ctrl-c does.
+    """
+    def __init__(self, panels=1, per_row=None, width=CANVAS_SIZE[0]):
+        self.panels = panels
+        ndigits = self.num_digits()
+        self.per_row = ndigits if per_row is None else per_row
+        rows = -(-ndigits // self.per_row)
+        self.scale = width / (self.per_row * totw + (self.per_row - 1) * DIGIT_GAP_W)
+        height = int(self.scale * (rows * toth + (rows - 1) * DIGIT_GAP_H)) + 1
+        self.nbits = panels * pixel_map.BITS
+        # [wire bit] -> (digit, segment in glyph data order), and back
+        self.wire_segments = [None] * self.nbits
+        self.segment_bits = []
+        for digit in range(ndigits):
+            bits = [pixel_map.segment_bit(panels, digit, segment)
+                    for segment in range(pixel_map.TOTAL_DIGIT_BITS)]
+            for (segment, bit) in enumerate(bits):
+                self.wire_segments[bit] = (digit, segment)
+            self.segment_bits.append(bits)
+        self.digit_origins = [
+            (digit % self.per_row * (totw + DIGIT_GAP_W),
+             digit // self.per_row * (toth + DIGIT_GAP_H))
+            for digit in range(ndigits)]
+        # polygon_rect adds a couple of pixels around the polygon
+        self.neighbors = segment_neighbors(3 / self.scale)
+        self.state = 0
+        self.frames_skipped = 0
+        self.segments_drawn = 0
+        pygame.init()
+        self.screen = pygame.display.set_mode((width, height))
+        self.screen.fill(COLOR_BACK)
+        pygame.display.flip()
+
+    def num_digits(self):
+        return self.panels * pixel_map.DIGITS
+
+    def new_window(self):
+        return pixel_map.Window(self.panels)
+
+    def lit(self, state, bit):
+        return (state >> (self.nbits - 1 - bit)) & 1
+
+    def erase_polygon(self, x, y, poly):
+        # the whole bounding box, so that no antialiased edge is left behind
+        self.screen.fill(COLOR_BACK, polygon_rect(x, y, poly, self.scale))
+
+    def blit(self, window):
+        self.blit_frame(window.frame())
+
+    def blit_frame(self, frame):
+        state = int.from_bytes(frame, 'big')
+        changed = state ^ self.state
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.close()
+                raise KeyboardInterrupt("window closed")
+        if changed == 0:
+            self.frames_skipped += 1
+            return
+        dirty = []
+        while changed:
+            low = changed & -changed
+            changed ^= low
+            bit = self.nbits - low.bit_length()
+            (digit, segment) = self.wire_segments[bit]
+            poly = SEGMENT_POLYS[segment]
+            # pad bits have no polygon
+            if not poly:
+                continue
+            (x, y) = self.digit_origins[digit]
+            self.segments_drawn += 1
+            if state & low:
+                draw_polygon(self.screen, x, y, poly, self.scale)
+            else:
+                self.erase_polygon(x, y, poly)
+                for neighbor in self.neighbors[segment]:
+                    if self.lit(state, self.segment_bits[digit][neighbor]):
+                        draw_polygon(self.screen, x, y, SEGMENT_POLYS[neighbor], self.scale)
+            dirty.append(polygon_rect(x, y, poly, self.scale))
+        self.state = state
+        pygame.display.update(dirty)
+
+    def close(self):
+        pygame.display.quit()
 
 def stack_debug_demo(screen):
     programs = [
@@ -546,7 +720,113 @@ def stack_debug_demo(screen):
                 pygame.Rect(SCALE*x, SCALE*y, SCALE*w, SCALE*h),
                 COLOR_DIGIT_BORDER)
 
+def sheet_size(nglyphs):
+    """Canvas size for a sheet of nglyphs; at least CANVAS_SIZE, taller if needed"""
+    rows = max(1, -(-nglyphs // PER_ROW))
+    return (CANVAS_SIZE[0], max(CANVAS_SIZE[1], int(tile_height(rows)) + 1))
+
+def tile_height(rows):
+    return SCALE * rows * (toth + DIGIT_GAP_H)
+
+# each worker process keeps these around between tiles
+_fonts = {}
+_atlas = None
+
+def render_tile(task):
+    """Render sheet rows [row_start, row_end) of a job; for the process pool"""
+    global _atlas
+    (job, font_filename, glyphs, row_start, row_end) = task
+    try:
+        if _atlas is None:
+            _atlas = GlyphAtlas()
+        if font_filename not in _fonts:
+            _fonts[font_filename] = pixel_map.Font(font_filename)
+        top = int(tile_height(row_start))
+        height = int(tile_height(row_end)) - top
+        surface = pygame.Surface((CANVAS_SIZE[0], height))
+        surface.fill(COLOR_BACK)
+        first = row_start * PER_ROW
+        render_array(surface, _fonts[font_filename], glyphs[first:row_end * PER_ROW], _atlas,
+                first, top)
+        return (job, top, surface.get_size(), pygame.image.tobytes(surface, 'RGB'))
+    except Exception as e:
+        # only this job is lost, the pool goes on with the rest
+        return (job, None, None, '%s: %s' % (type(e).__name__, e))
+
+def render_batch(jobs, rows_per_tile=2, processes=None):
+    """Render (output filename, font filename, glyphs) jobs to png files without a window
+
+    Sheets are cut into bands of rows_per_tile rows rendered in parallel worker processes and
+    stitched back together. Yields each output filename once it has been saved; a job that fails
+    is reported on stderr and left out, without stopping the others.
+    """
+    tasks = []
+    canvases = {}
+    pending = {}
+    errors = {}
+    for (job, (out_filename, font_filename, glyphs)) in enumerate(jobs):
+        glyphs = list(glyphs)
+        canvases[job] = pygame.Surface(sheet_size(len(glyphs)))
+        canvases[job].fill(COLOR_BACK)
+        rows = max(1, -(-len(glyphs) // PER_ROW))
+        for row_start in range(0, rows, rows_per_tile):
+            row_end = min(rows, row_start + rows_per_tile)
+            tasks.append((job, font_filename, glyphs, row_start, row_end))
+            pending[job] = pending.get(job, 0) + 1
+    with Pool(processes) as pool:
+        for (job, top, size, data) in pool.imap_unordered(render_tile, tasks):
+            if top is None:
+                errors.setdefault(job, data)
+            else:
+                canvases[job].blit(pygame.image.frombytes(data, size, 'RGB'), (0, top))
+            pending[job] -= 1
+            if pending[job] == 0:
+                out_filename = jobs[job][0]
+                canvas = canvases.pop(job)
+                if job in errors:
+                    print("%s: failed, %s" % (out_filename, errors.pop(job)), file=sys.stderr)
+                    continue
+                pygame.image.save(canvas, out_filename)
+                yield out_filename
+
+def batch_main(args):
+    parser = ArgumentParser(prog='pixel_gfx.py --batch',
+            description='Render texts with one or more fonts to png files, without a window')
+    parser.add_argument('outdir', help='where to put the images, named font-line.png')
+    parser.add_argument('fonts', nargs='+', help='firmware images to take the font from')
+    parser.add_argument('-i', '--input', default='-',
+            help='texts, one per line; stdin by default. Without any, whole font sheets')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args(args)
+
+    if args.input == '-':
+        texts = sys.stdin.read().splitlines()
+    else:
+        texts = open(args.input).read().splitlines()
+    # the fonts only have latin-1; anything else is blank, like on the panels
+    glyph_lists = [[pixel_map.glyph_index(ord(ch)) for ch in text] for text in texts]
+    if not glyph_lists:
+        glyph_lists = [range(256)]
+
+    os.makedirs(args.outdir, exist_ok=True)
+    jobs = []
+    for font_filename in args.fonts:
+        stem = os.path.splitext(os.path.basename(font_filename))[0]
+        for (i, glyphs) in enumerate(glyph_lists):
+            out_filename = os.path.join(args.outdir, '%s-%04d.png' % (stem, i))
+            jobs.append((out_filename, font_filename, glyphs))
+    saved = 0
+    for out_filename in render_batch(jobs, processes=args.jobs):
+        print(out_filename, flush=True)
+        saved += 1
+    if saved < len(jobs):
+        sys.exit(1)
+
 def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == '--batch':
+        batch_main(sys.argv[2:])
+        return
+
     pygame.init()
     screen = pygame.display.set_mode(CANVAS_SIZE)
     screen.fill(COLOR_BACK)
@@ -561,6 +841,7 @@ def main():
         else:
             # draw them all by default
             text = range(256)
+        # the exact path; render.png is meant as a reference
         render_array(screen, font, text)
 
     pygame.display.flip()
@@ -1,7 +1,20 @@
 #!/usr/bin/env python3
 
-from time import sleep, time
+from time import sleep, time, monotonic
+from functools import lru_cache
+from collections import deque
+from statistics import pstdev
+from threading import Thread, Condition, Barrier, BrokenBarrierError, Lock
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from serial import Serial
+import json
+import mmap
+import os
+import socket
+import stat
+import sys
+from hashlib import sha256
+from pad_bits import load_pad_bits
 from sys import argv
 
 # below values per one four-digit panel
@@ -25,6 +38,11 @@ UPPER_DIGIT_BITS = 80 # 7 rows including the umlaut region
 LOWER_DIGIT_BITS = 40 # 4 rows
 TOTAL_DIGIT_BITS = UPPER_DIGIT_BITS + LOWER_DIGIT_BITS # 120
 BITS = DIGITS * TOTAL_DIGIT_BITS # 480
+# all of the above happen to be byte aligned, so glyphs can be moved as whole bytes
+UPPER_DIGIT_BYTES = UPPER_DIGIT_BITS // 8 # 10
+LOWER_DIGIT_BYTES = LOWER_DIGIT_BITS // 8 # 5
+TOTAL_DIGIT_BYTES = TOTAL_DIGIT_BITS // 8 # 15
+BYTES = BITS // 8 # 60
 
 # size of the consistent(ish) region; the second-last row has physical gaps though.
 W = 5
@@ -115,8 +133,8 @@ PIXEL_MAP = [
         [(b, 6), (b, 5)],
 ]
 
-def render_segment(screen, digit, digit_segment, color=1):
-    npanels = len(screen) // BITS
+def segment_bit(npanels, digit, digit_segment):
+    """Wire bit index of a digit-relative segment bit in a chain of npanels"""
     panel_offset = (npanels - 1 - (digit // 4)) * BITS
     digit %= 4
 
@@ -131,13 +149,96 @@ def render_segment(screen, digit, digit_segment, color=1):
         # digits go left to right; leftmost digit is clocked in first
         digit_offset = DIGITS * UPPER_DIGIT_BITS + digit * LOWER_DIGIT_BITS
 
-    screen[panel_offset + digit_offset + digit_segment] = color
+    return panel_offset + digit_offset + digit_segment
 
-def render_pixel_segment(screen, digit, segment_spec, color=1):
+def spec_segment(segment_spec):
+    """Digit-relative segment bit of a PIXEL_MAP (label, column) spec"""
     offset_in_digit = BITS_PER_LABEL * segment_spec[0] + segment_spec[1]
     # the segments were originally specified inverted so invert it back
-    segment = TOTAL_DIGIT_BITS - 1 - offset_in_digit
-    render_segment(screen, digit, segment, color)
+    return TOTAL_DIGIT_BITS - 1 - offset_in_digit
+
+def render_segment(screen, digit, digit_segment, color=1):
+    npanels = len(screen) // BITS
+    screen[segment_bit(npanels, digit, digit_segment)] = color
+
+def render_pixel_segment(screen, digit, segment_spec, color=1):
+    render_segment(screen, digit, spec_segment(segment_spec), color)
+
+# all the above arithmetic done once per panel count; putpixel and friends just look up bits here
+@lru_cache(maxsize=None)
+def pixel_index(npanels):
+    """[digit][PIXEL_MAP index] -> tuple of wire bit indices for a chain of npanels"""
+    return tuple(
+        tuple(
+            tuple(segment_bit(npanels, digit, spec_segment(seg)) for seg in pixel)
+            for pixel in PIXEL_MAP)
+        for digit in range(npanels * DIGITS))
+
+@lru_cache(maxsize=None)
+def packed_pixel_index(npanels):
+    """Like pixel_index, but (byte offset, bit mask) pairs into a packed frame"""
+    return tuple(
+        tuple(
+            tuple((bit >> 3, 0x80 >> (bit & 7)) for bit in pixel)
+            for pixel in digit)
+        for digit in pixel_index(npanels))
+
+@lru_cache(maxsize=None)
+def digit_byte_offsets(npanels):
+    """[digit] -> (upper, lower) byte offsets of each digit's data in a packed frame"""
+    offsets = []
+    for digit in range(npanels * DIGITS):
+        panel_off = (npanels - 1 - (digit // DIGITS)) * BYTES
+        panel_digit = digit % DIGITS
+        panel_digit_rtl = DIGITS - 1 - panel_digit
+        # rightmost digit goes first for top row
+        upper_off = panel_digit_rtl * UPPER_DIGIT_BYTES
+        # leftmost digit goes first for bottom row
+        lower_off = DIGITS * UPPER_DIGIT_BYTES + panel_digit * LOWER_DIGIT_BYTES
+        offsets.append((panel_off + upper_off, panel_off + lower_off))
+    return tuple(offsets)
+
+@lru_cache(maxsize=None)
+def fill_mask(npanels):
+    """Every wire bit that belongs to some pixel, as one big-endian int for a chain of npanels"""
+    mask = 0
+    for digit in pixel_index(npanels):
+        for pixel in digit:
+            for bit in pixel:
+                mask |= 1 << (npanels * BITS - 1 - bit)
+    return mask
+
+@lru_cache(maxsize=None)
+def pad_mask(npanels):
+    """The bits that docs/lcd_panel/pad_bits.txt lists as padding, as one big-endian int for a
+    chain of npanels; they only cause artefacts"""
+    pads = load_pad_bits()
+    mask = 0
+    for panel in range(npanels):
+        for bit in pads:
+            mask |= 1 << (npanels * BITS - 1 - (panel * BITS + bit))
+    return mask
+
+@lru_cache(maxsize=None)
+def keep_mask(npanels):
+    """Every bit except the pad bits"""
+    return ((1 << (npanels * BITS)) - 1) & ~pad_mask(npanels)
+
+def describe_bit(npanels, bit):
+    """(digit, digit-relative segment bit) of a wire bit; the inverse of segment_bit"""
+    panel = npanels - 1 - bit // BITS
+    bit %= BITS
+    if bit < DIGITS * UPPER_DIGIT_BITS:
+        (digit_rtl, segment) = divmod(bit, UPPER_DIGIT_BITS)
+        digit = DIGITS - 1 - digit_rtl
+    else:
+        (digit, segment) = divmod(bit - DIGITS * UPPER_DIGIT_BITS, LOWER_DIGIT_BITS)
+        segment += UPPER_DIGIT_BITS
+    return (panel * DIGITS + digit, segment)
+
+# set PIXEL_MAP_CHECK_PADS=1 to have Window.frame complain about anything written to pad bits;
+# asserted, so python -O turns it off again
+CHECK_PADS = bool(os.environ.get('PIXEL_MAP_CHECK_PADS'))
 
 # "big endian"
 def squeeze_bits_be(bytebits):
@@ -167,11 +268,230 @@ def unit_test_bitstuff():
 
 unit_test_bitstuff()
 
+class Histogram:
+    """Durations of the last window samples in power of two microsecond buckets"""
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        # bucket n holds durations below 2**n us
+        self.counts = [0] * 32
+        self.total = 0.0
+
+    def add(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), len(self.counts) - 1)
+        if len(self.samples) == self.samples.maxlen:
+            (old_seconds, old_bucket) = self.samples[0]
+            self.counts[old_bucket] -= 1
+            self.total -= old_seconds
+        self.samples.append((seconds, bucket))
+        self.counts[bucket] += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket with the pth percentile, in seconds"""
+        rank = p / 100.0 * len(self.samples)
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return (1 << bucket) / 1e6
+        return 0.0
+
+    def summary(self):
+        n = len(self.samples)
+        return {
+            'count': n,
+            'mean': self.total / n if n else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': max(seconds for (seconds, bucket) in self.samples) if n else 0.0,
+            # "<N us": count
+            'buckets': {'<%d us' % (1 << bucket): count
+                for (bucket, count) in enumerate(self.counts) if count},
+        }
+
+def unit_test_histogram():
+    h = Histogram(window=4)
+    for us in (1, 3, 3, 100, 5):
+        h.add(us / 1e6)
+    # the 1 us one has rolled out
+    assert h.summary()['count'] == 4
+    assert h.counts[1] == 0 and h.counts[2] == 2 and h.counts[3] == 1 and h.counts[7] == 1
+    assert h.percentile(50) == 4e-6
+    assert h.percentile(100) == 128e-6
+
+unit_test_histogram()
+
+class DisplayStats:
+    """Where the time goes per frame, for a Display given one; without one nothing is measured
+
+    Phases: render (making the frames, measured in FrameScheduler.play), pack (getting the wire
+    bytes of a window), ack_wait (reading back the previous frame's acks), write, and flush.
+    latch_wait is how long a MultiDisplay chain with sync_latch waited at the latch for the other
+    chains. ack_latency is from the flush to the last ack byte, measured only when the acks
+    weren't all there yet at the first read, as otherwise it would include idle time.
+    """
+    PHASES = ('render', 'pack', 'ack_wait', 'write', 'latch_wait', 'flush', 'ack_latency')
+
+    def __init__(self, window=1000):
+        self.lock = Lock()
+        self.histograms = {phase: Histogram(window) for phase in self.PHASES}
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.histograms[phase].add(seconds)
+
+    def sent(self, nbytes):
+        with self.lock:
+            self.frames_sent += 1
+            self.bytes_sent += nbytes
+
+    def skipped(self):
+        with self.lock:
+            self.frames_skipped += 1
+
+    def timed(self, phase, frames):
+        """Pass frames through from an iterator, timing how long each takes to make"""
+        frames = iter(frames)
+        while True:
+            a = monotonic()
+            try:
+                frame = next(frames)
+            except StopIteration:
+                return
+            self.add(phase, monotonic() - a)
+            yield frame
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time(),
+                'frames_sent': self.frames_sent,
+                'frames_skipped': self.frames_skipped,
+                'bytes_sent': self.bytes_sent,
+                'phases': {phase: h.summary() for (phase, h) in self.histograms.items()},
+            }
+
+class StatsExporter:
+    """Dumps a DisplayStats snapshot every interval seconds from a thread
+
+    json_filename is replaced with the latest snapshot each time. socket_path is a unix socket
+    that sends the snapshots as lines of json to everyone connected, for example with
+    socat - UNIX-CONNECT:socket_path; a client that doesn't keep up is disconnected.
+    """
+    def __init__(self, stats, interval=1.0, json_filename=None, socket_path=None):
+        self.stats = stats
+        self.interval = interval
+        self.json_filename = json_filename
+        self.socket_path = socket_path
+        self.server = None
+        self.clients = []
+        if socket_path is not None:
+            try:
+                st = os.stat(socket_path)
+            except FileNotFoundError:
+                pass
+            else:
+                # left over from an earlier run; anything else there is not ours to delete
+                if not stat.S_ISSOCK(st.st_mode):
+                    raise FileExistsError("%s exists and is not a socket" % socket_path)
+                os.unlink(socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(socket_path)
+            self.server.listen()
+            self.server.setblocking(False)
+        self.cond = Condition()
+        self.closing = False
+        self.thread = Thread(target=self.run, name="stats exporter", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closing, self.interval)
+                if self.closing:
+                    break
+            self.dump()
+
+    def dump(self):
+        data = json.dumps(self.stats.snapshot())
+        if self.json_filename is not None:
+            tmp = self.json_filename + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.json_filename)
+        if self.server is not None:
+            while True:
+                try:
+                    client = self.server.accept()[0]
+                except BlockingIOError:
+                    break
+                # never wait for a client; one that stops reading fills its buffer and is dropped
+                client.setblocking(False)
+                self.clients.append(client)
+            line = (data + '\n').encode()
+            for client in list(self.clients):
+                try:
+                    client.sendall(line)
+                except OSError:
+                    client.close()
+                    self.clients.remove(client)
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
+        for client in self.clients:
+            client.close()
+        if self.server is not None:
+            self.server.close()
+            os.unlink(self.socket_path)
+
+# Bytes that fit between the host and the proxy before the proxy has to take them: the Uno's
+# usb to serial bridge buffers 128. Anything more waits in the host's tty buffer, held back by usb
+# flow control, so going over is safe; it just adds latency.
+PROXY_BUFFER_BYTES = 128
+
+def frames_in_flight(frame_bytes, buffer_bytes=PROXY_BUFFER_BYTES):
+    """How many frames to have sent but not yet acked: the one being shifted out, plus as many as
+    fit in the buffers on the way, but at least one so that the link doesn't sit idle for an ack
+    roundtrip between frames"""
+    return 1 + max(1, buffer_bytes // frame_bytes)
+
+# Display ack_bytes for each proxy firmware, by the names proxy_emu.py uses too
+FIRMWARE_ACK_BYTES = {
+    'ino': None,
+    'c': 1,
+}
+
 class Display:
-    def __init__(self, port, panels=1):
+    # keepalive: resend an unchanged frame anyway if this many seconds have passed since the last
+    # write; None to never resend
+    # ack_bytes: how many bytes the proxy sends back per frame; None for one per byte sent plus a
+    # '.' per latch like proxy.ino does, 1 for the single 0xff per latch of proxy.c
+    # stats: a DisplayStats to collect timings in, or None to not measure anything
+    # in_flight: how many frames may be sent ahead of their acks; None for frames_in_flight, 1 to
+    # wait for each frame's acks before sending the next one
+    def __init__(self, port, panels=1, keepalive=None, ack_bytes=None, stats=None,
+            in_flight=None):
         self.port = port
         self.panels = panels
-        self.prev_sent = 0
+        self.keepalive = keepalive
+        self.ack_bytes = ack_bytes
+        self.stats = stats
+        if in_flight is None:
+            in_flight = frames_in_flight(panels * BYTES)
+        self.in_flight = in_flight
+        # ack bytes still to come for each sent frame, oldest first, and when each was flushed
+        self.pending_acks = deque()
+        self.flushed_times = deque()
+        # identical frames are not sent again; see blit
+        self.last_frame = None
+        self.last_sent_time = 0.0
+        self.frames_skipped = 0
 
     def num_digits(self):
         return self.panels * DIGITS
@@ -179,55 +499,338 @@ class Display:
     def new_window(self):
         return Window(self.panels)
 
-    def blit(self, window):
-        tot = 0
-        while tot < self.prev_sent:
-            r = self.port.read(9999999)
-            tot += len(r)
+    def unchanged(self, frame):
+        if frame != self.last_frame:
+            return False
+        if self.keepalive is None:
+            return True
+        return monotonic() - self.last_sent_time < self.keepalive
+
+    def wait_acks(self, keep=0):
+        """Read acks until at most keep frames are waiting for theirs"""
+        stats = self.stats
+        if stats is not None:
+            a = monotonic()
+            reads = 0
+        pending = self.pending_acks
+        while len(pending) > keep:
+            # acks come in order, so they all go to the oldest frame first
+            r = self.port.read(pending[0])
+            pending[0] -= len(r)
+            if stats is not None:
+                reads += 1
+            if pending[0] == 0:
+                pending.popleft()
+                flushed_time = self.flushed_times.popleft()
+                if stats is not None and reads > 1:
+                    stats.add('ack_latency', monotonic() - flushed_time)
             #sleep(0.00001)
+        if stats is not None:
+            stats.add('ack_wait', monotonic() - a)
 
-        compress = True
-        if compress:
-            bs = list(bitstring_to_bytestring_be(window.pixels))
-            assert window.pixels == list(expand_bits_be(bs))
-            nsent = self.port.write(bytes(bs))
-            assert nsent == len(window.pixels) // 8
+    def send(self, frame, latch_barrier=None):
+        stats = self.stats
+        if latch_barrier is None:
+            # room for this one
+            self.wait_acks(self.in_flight - 1)
+            if stats is not None:
+                a = monotonic()
+            nsent = self.port.write(frame)
+            if stats is not None:
+                write_time = monotonic() - a
         else:
-            nsent = self.port.write(bytes(window.pixels))
-            assert nsent == len(window.pixels)
+            # the proxy latches when the last byte arrives; hold it back until every chain sharing
+            # the barrier has received the rest so that they all latch at about the same time
+            try:
+                self.wait_acks(self.in_flight - 1)
+                if stats is not None:
+                    a = monotonic()
+                nsent = self.port.write(frame[:-1])
+                self.port.flush()
+                if stats is not None:
+                    write_time = monotonic() - a
+            except BaseException:
+                # or the other chains would wait for this one forever
+                latch_barrier.abort()
+                raise
+            if stats is not None:
+                a = monotonic()
+            try:
+                latch_barrier.wait()
+            except BrokenBarrierError:
+                # another chain failed; latch anyway rather than leave this proxy a byte short
+                pass
+            if stats is not None:
+                b = monotonic()
+                # kept out of write, it's the other chains that are slow
+                stats.add('latch_wait', b - a)
+            nsent += self.port.write(frame[-1:])
+            if stats is not None:
+                write_time += monotonic() - b
+        assert nsent == len(frame)
+        if stats is not None:
+            b = monotonic()
+            stats.add('write', write_time)
         self.port.flush()
-        self.prev_sent = nsent
+        flushed_time = monotonic()
+        if stats is not None:
+            stats.add('flush', flushed_time - b)
+            stats.sent(nsent)
+        self.pending_acks.append(nsent + 1 if self.ack_bytes is None else self.ack_bytes)
+        self.flushed_times.append(flushed_time)
+
+    def blit(self, window):
+        # already packed in wire order, only the pad bits get masked off
+        if self.stats is None:
+            self.blit_frame(window.frame())
+            return
+        a = monotonic()
+        frame = window.frame()
+        self.stats.add('pack', monotonic() - a)
+        self.blit_frame(frame)
+
+    def blit_frame(self, frame, latch_barrier=None):
+        # a whole transfer and ack roundtrip saved if the panel already shows this; not with a
+        # barrier though, as the other chains would wait for this one forever
+        if latch_barrier is None and self.unchanged(frame):
+            self.frames_skipped += 1
+            if self.stats is not None:
+                self.stats.skipped()
+            return
+
+        self.send(frame, latch_barrier)
+        self.last_frame = bytes(frame)
+        self.last_sent_time = monotonic()
+
+    def close(self):
+        self.wait_acks()
+
+class ThreadedDisplay(Display):
+    """Display that sends frames from a writer thread so that rendering overlaps transmission
+
+    blit() only copies the frame to a queue of at most depth frames. If the writer falls behind,
+    the oldest queued frame is dropped (and counted in frames_dropped) in favor of the newest one;
+    a panel that can't keep up shows the latest state instead of lagging further behind.
+
+    The port is given a small read timeout so that the writer sleeps in read() instead of
+    spinning while waiting for acks.
+    """
+    def __init__(self, port, panels=1, keepalive=None, ack_bytes=None, depth=2,
+            read_timeout=0.01, stats=None):
+        super().__init__(port, panels, keepalive, ack_bytes, stats)
+        self.port.timeout = read_timeout
+        self.queue = deque()
+        self.depth = depth
+        self.cond = Condition()
+        self.busy = False
+        # set by sync: read every outstanding ack once the queue is empty
+        self.draining = False
+        self.closing = False
+        self.error = None
+        self.frames_dropped = 0
+        self.thread = Thread(target=self.writer, name="display writer", daemon=True)
+        self.thread.start()
+
+    def writer(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.queue and not self.closing and not self.draining:
+                        self.cond.wait()
+                    if self.queue:
+                        frame = self.queue.popleft()
+                    elif self.closing:
+                        break
+                    else:
+                        frame = None
+                    self.busy = True
+                    self.cond.notify_all()
+                if frame is None:
+                    self.wait_acks()
+                else:
+                    self.send(frame)
+                with self.cond:
+                    if frame is None:
+                        self.draining = False
+                    self.busy = False
+                    self.cond.notify_all()
+            self.wait_acks()
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self.queue.clear()
+                self.busy = False
+                self.draining = False
+                self.cond.notify_all()
+
+    def blit_frame(self, frame, latch_barrier=None):
+        assert latch_barrier is None, "can't latch in sync from the writer thread"
+        if self.unchanged(frame):
+            self.frames_skipped += 1
+            if self.stats is not None:
+                self.stats.skipped()
+            return
+        frame = bytes(frame)
+        with self.cond:
+            if self.error is not None:
+                raise self.error
+            if len(self.queue) >= self.depth:
+                self.queue.popleft()
+                self.frames_dropped += 1
+            self.queue.append(frame)
+            self.cond.notify_all()
+        self.last_frame = frame
+        self.last_sent_time = monotonic()
+
+    def sync(self):
+        """Wait until every queued frame has been written and acked"""
+        with self.cond:
+            self.draining = True
+            self.cond.notify_all()
+            while (self.queue or self.busy or self.draining) and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+class MultiDisplay:
+    """One wide board split over several Displays, each on its own port and proxy
+
+    The displays are given left to right and share one logical digit range; windows span all of
+    them. Each chain's part of a frame is sent from its own thread, so the aggregate bandwidth
+    grows with the number of ports. With sync_latch, every chain gets every frame and the byte
+    that triggers the latch is held back until all chains have received the rest of theirs.
+
+    frames_skipped counts frames where no chain had anything new; without sync_latch a chain can
+    still skip its own part of a frame, which is counted in that Display.
+    """
+    def __init__(self, displays, sync_latch=False):
+        self.displays = displays
+        self.panels = sum(display.panels for display in displays)
+        self.pool = ThreadPoolExecutor(max_workers=len(displays))
+        self.barrier = Barrier(len(displays)) if sync_latch else None
+        self.frames_skipped = 0
+        # the leftmost panel is at the end of a frame, so the first display gets the last bytes
+        self.slices = []
+        end = self.panels * BYTES
+        for display in displays:
+            start = end - display.panels * BYTES
+            self.slices.append(slice(start, end))
+            end = start
+
+    def num_digits(self):
+        return self.panels * DIGITS
+
+    def new_window(self):
+        return Window(self.panels)
+
+    def blit(self, window):
+        self.blit_frame(window.frame())
+
+    def blit_frame(self, frame):
+        parts = [frame[s] for s in self.slices]
+        # with a barrier it has to be all or nothing, or the barrier would never open
+        if all(d.unchanged(part) for (d, part) in zip(self.displays, parts)):
+            self.frames_skipped += 1
+            return
+        jobs = [self.pool.submit(display.blit_frame, part, self.barrier)
+                for (display, part) in zip(self.displays, parts)]
+        # every chain done before raising anything, so none is left holding the barrier
+        wait_futures(jobs)
+        if self.barrier is not None and self.barrier.broken:
+            self.barrier.reset()
+        for job in jobs:
+            job.result()
+
+    def close(self):
+        for display in self.displays:
+            display.close()
+        self.pool.shutdown()
 
 class Window:
-    def __init__(self, panels=1):
+    """A frame for a chain of panels, packed msb first in wire order like it's sent
+
+    Drawing doesn't check for pad bits; frame() clears them all at once, and with check_pads
+    first complains about any that were set.
+    """
+    def __init__(self, panels=1, check_pads=CHECK_PADS):
         self.panels = panels
-        self.pixels = [0] * (panels * BITS)
+        self.buf = bytearray(panels * BITS // 8)
+        self.index = packed_pixel_index(panels)
+        self.keep = keep_mask(panels)
+        self.check_pads = check_pads
 
     def num_digits(self):
         return self.panels * DIGITS
 
+    def frame(self):
+        lit = int.from_bytes(self.buf, 'big')
+        if __debug__ and self.check_pads:
+            self.validate(lit)
+        return memoryview((lit & self.keep).to_bytes(len(self.buf), 'big'))
+
+    def validate(self, lit):
+        stray = lit & ~self.keep
+        nbits = self.panels * BITS
+        assert stray == 0, "pad bits set: " + ', '.join(
+            "digit %d segment %d" % describe_bit(self.panels, bit)
+            for bit in range(nbits) if stray >> (nbits - 1 - bit) & 1)
+
+    @property
+    def pixels(self):
+        """One int per bit, as a copy; handy for debugging but slow"""
+        return list(expand_bits_be(self.buf))
+
+    def getbit(self, bit):
+        return 1 if self.buf[bit >> 3] & (0x80 >> (bit & 7)) else 0
+
+    def setbit(self, bit, color=1):
+        if color:
+            self.buf[bit >> 3] |= 0x80 >> (bit & 7)
+        else:
+            self.buf[bit >> 3] &= ~(0x80 >> (bit & 7))
+
+    def set_pixel_bits(self, pixel, color):
+        buf = self.buf
+        if color:
+            for (byte, mask) in pixel:
+                buf[byte] |= mask
+        else:
+            for (byte, mask) in pixel:
+                buf[byte] &= ~mask
+
     def putpixel(self, digit, x, y, color=1):
-        skip_highrow_y = 1 + y
-        for segment in PIXEL_MAP[skip_highrow_y * W + x]:
-            render_pixel_segment(self.pixels, digit, segment, color)
+        # y == -1 is the top row
+        self.set_pixel_bits(self.index[digit][(1 + y) * W + x], color)
 
     def fillx(self, d, y, color=1):
-        for x in range(W):
-            self.putpixel(d, x, y, color)
+        row = (1 + y) * W
+        for pixel in self.index[d][row:row + W]:
+            self.set_pixel_bits(pixel, color)
 
     def filly(self, d, x, color=1):
+        digit_index = self.index[d]
         for y in range(H):
-            self.putpixel(d, x, y, color)
+            self.set_pixel_bits(digit_index[(1 + y) * W + x], color)
 
     def fill(self):
-        for digit in range(self.num_digits()):
-            for pixel in PIXEL_MAP:
-                for seg in pixel:
-                    render_pixel_segment(self.pixels, digit, seg, 1)
+        nbytes = len(self.buf)
+        lit = int.from_bytes(self.buf, 'big') | fill_mask(self.panels)
+        self.buf[:] = lit.to_bytes(nbytes, 'big')
 
     def insert_raw(self, offset, segments):
         for (i, segbit) in enumerate(segments):
-            self.pixels[offset + i] = segbit
+            self.setbit(offset + i, segbit)
+
+    def insert_bytes(self, byte_offset, data):
+        self.buf[byte_offset:byte_offset + len(data)] = data
 
 def unit_test_render():
     window = Window()
@@ -236,99 +839,473 @@ def unit_test_render():
     # segments a4, a3, a2, a1, a0
     assert window.pixels[-5:] == [0, 1, 1, 1, 0]
 
+    # the lookup tables must agree with the segment arithmetic
+    for panels in (1, 2):
+        window = Window(panels)
+        slow = [0] * (panels * BITS)
+        for digit in range(window.num_digits()):
+            for pixel in PIXEL_MAP:
+                for seg in pixel:
+                    render_pixel_segment(slow, digit, seg)
+        window.fill()
+        assert window.pixels == slow
+
 unit_test_render()
 
+def unit_test_pads():
+    for panels in (1, 2):
+        # pad_bits.txt and PIXEL_MAP agree: every bit is either padding or part of a pixel
+        assert pad_mask(panels) == ~fill_mask(panels) & ((1 << (panels * BITS)) - 1)
+        window = Window(panels, check_pads=False)
+        window.fill()
+        lit = bytes(window.frame())
+        for bit in range(panels * BITS):
+            (digit, segment) = describe_bit(panels, bit)
+            assert segment_bit(panels, digit, segment) == bit
+            window.setbit(bit)
+        assert bytes(window.frame()) == lit
+    if __debug__:
+        window = Window(check_pads=True)
+        # digit 3 segment 0 is a pad bit
+        window.setbit(segment_bit(1, 3, 0))
+        try:
+            window.frame()
+        except AssertionError as e:
+            assert 'digit 3 segment 0' in str(e)
+        else:
+            assert False, "pad bit not caught"
+
+unit_test_pads()
+
+# where the glyphs are in zel09101
+FONT_BASE = 0x400 # 1KB
+FONT_STRIDE = TOTAL_DIGIT_BYTES
+# in latin-1 order
+GLYPHS = 256
+# characters past the font show up as this, an all blank glyph after the real ones
+BLANK_GLYPH = GLYPHS
+
+def glyph_index(code):
+    """Font glyph for a character code"""
+    return code if 0 <= code < GLYPHS else BLANK_GLYPH
+
+# parsed fonts are kept here, keyed by the hash of the firmware image they came from
+FONT_CACHE_DIR = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+        'lentokenttanaytto')
+
 class Font:
-    def __init__(self, fw_filename):
-        self.glyphdata = Font.load_font(fw_filename)
+    """256 glyphs of packed 15-byte digit data, loaded from a firmware image on first use
+
+    base None finds the glyph table with binfind/fontfind.py, for firmware images other than
+    zel09101. The parsed glyphs are cached on disk in cache_dir (None to not cache), so the next
+    start only has to hash the image.
+    """
+    def __init__(self, fw_filename, base=FONT_BASE, stride=FONT_STRIDE, cache_dir=FONT_CACHE_DIR):
+        self.fw_filename = fw_filename
+        self.base = base
+        self.stride = stride
+        self.cache_dir = cache_dir
+        self._data = None
+        self._glyph_data = None
+        self._stamps = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load()
+        return self._data
 
-    def load_font(fw_filename):
-        bytestring = open(fw_filename, 'rb').read()
-        font_base_addr = 0x400 # 1KB
-        glyphs = 256
-        font_bytes = bytestring[font_base_addr:][:glyphs * TOTAL_DIGIT_BITS]
-        return list(expand_bits_be(font_bytes))
+    @property
+    def glyph_data(self):
+        """data with BLANK_GLYPH at the end"""
+        if self._glyph_data is None:
+            self._glyph_data = self.data + bytes(TOTAL_DIGIT_BYTES)
+        return self._glyph_data
+
+    @property
+    def upper_stamps(self):
+        return self.stamps()[0]
+
+    @property
+    def lower_stamps(self):
+        return self.stamps()[1]
+
+    def stamps(self):
+        # glyph data split to the packed pieces that go in the upper and lower regions; these are
+        # byte aligned at every digit position so rendering is just copying them in place
+        if self._stamps is None:
+            data = memoryview(self.glyph_data)
+            upper = []
+            lower = []
+            for glyph_off in range(0, len(data), TOTAL_DIGIT_BYTES):
+                upper.append(data[glyph_off:glyph_off + UPPER_DIGIT_BYTES])
+                lower.append(data[glyph_off + UPPER_DIGIT_BYTES:glyph_off + TOTAL_DIGIT_BYTES])
+            self._stamps = (upper, lower)
+        return self._stamps
+
+    def cache_filename(self, fw_hash):
+        where = 'auto' if self.base is None else '%x-%d' % (self.base, self.stride)
+        return os.path.join(self.cache_dir, '%s-%s.font' % (fw_hash, where))
+
+    def load(self):
+        with open(self.fw_filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fw:
+                if self.cache_dir is None:
+                    return Font.parse_font(fw, self.base, self.stride, self.fw_filename)
+                cache_filename = self.cache_filename(sha256(fw).hexdigest())
+                try:
+                    with open(cache_filename, 'rb') as cached:
+                        data = cached.read()
+                    # a short or otherwise broken cache file is parsed again and replaced
+                    if len(data) == GLYPHS * TOTAL_DIGIT_BYTES:
+                        return data
+                except OSError:
+                    pass
+                data = Font.parse_font(fw, self.base, self.stride, self.fw_filename)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # renamed in place so that a concurrent start never reads half a file
+            tmp_filename = '%s.%d' % (cache_filename, os.getpid())
+            with open(tmp_filename, 'wb') as cached:
+                cached.write(data)
+            os.replace(tmp_filename, cache_filename)
+        except OSError:
+            # it's just a cache
+            pass
+        return data
+
+    def locate(fw_filename):
+        binfind = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'binfind')
+        if binfind not in sys.path:
+            sys.path.append(binfind)
+        import fontfind
+        return fontfind.find_font(fw_filename)
+
+    def parse_font(fw, base, stride, fw_filename=None):
+        if base is None:
+            (base, stride) = Font.locate(fw_filename)
+        # without any padding between glyphs, if there was some
+        return b''.join(fw[base + glyph * stride:base + glyph * stride + TOTAL_DIGIT_BYTES]
+                for glyph in range(GLYPHS))
 
     def get_glyph_data(self, glyph):
-        return self.glyphdata[glyph * TOTAL_DIGIT_BITS:][:TOTAL_DIGIT_BITS]
+        """Packed, like a digit in the upper and lower regions back to back"""
+        glyph = glyph_index(glyph)
+        return memoryview(self.glyph_data)[glyph * TOTAL_DIGIT_BYTES:(glyph + 1) * TOTAL_DIGIT_BYTES]
 
     def render_glyph(self, window, digit, glyph):
-        panel_off = (window.panels - 1 - (digit // DIGITS)) * BITS
-        panel_digit = digit % DIGITS
-        panel_digit_rtl = DIGITS - 1 - panel_digit
-        # rightmost digit goes first for top row
-        upper_off = panel_digit_rtl * UPPER_DIGIT_BITS
-        # leftmost digit goes first for bottom row
-        lower_off = DIGITS * UPPER_DIGIT_BITS + panel_digit * LOWER_DIGIT_BITS
-        data = self.get_glyph_data(glyph)
-        window.insert_raw(panel_off + upper_off, data[:UPPER_DIGIT_BITS])
-        window.insert_raw(panel_off + lower_off, data[UPPER_DIGIT_BITS:])
+        glyph = glyph_index(glyph)
+        (upper_off, lower_off) = digit_byte_offsets(window.panels)[digit]
+        window.insert_bytes(upper_off, self.upper_stamps[glyph])
+        window.insert_bytes(lower_off, self.lower_stamps[glyph])
 
     def render(self, window, text):
-        for (digit, ch) in enumerate(text):
+        offsets = digit_byte_offsets(window.panels)
+        buf = window.buf
+        upper_stamps = self.upper_stamps
+        lower_stamps = self.lower_stamps
+        for ((upper_off, lower_off), ch) in zip(offsets, text):
             # this happens to be in ascii order! Plus åäö work out of the box.
-            self.render_glyph(window, digit, ord(ch))
+            glyph = glyph_index(ord(ch))
+            buf[upper_off:upper_off + UPPER_DIGIT_BYTES] = upper_stamps[glyph]
+            buf[lower_off:lower_off + LOWER_DIGIT_BYTES] = lower_stamps[glyph]
+
+@lru_cache(maxsize=None)
+def column_bits(npanels):
+    """[display column][row] -> big-endian int of the wire bits of that pixel; row 0 is the top row"""
+    columns = []
+    for digit in pixel_index(npanels):
+        for x in range(W):
+            rows = []
+            for y in range(1 + H):
+                bits = 0
+                for bit in digit[y * W + x]:
+                    bits |= 1 << (npanels * BITS - 1 - bit)
+                rows.append(bits)
+            columns.append(tuple(rows))
+    return tuple(columns)
+
+def glyph_columns(glyph_data):
+    """The W pixel columns of a glyph as row bitmasks (bit 0 is the top row); a pixel is lit if
+    any of its segments is"""
+    lit = int.from_bytes(glyph_data, 'big')
+    columns = []
+    for x in range(W):
+        mask = 0
+        for y in range(1 + H):
+            for seg in PIXEL_MAP[y * W + x]:
+                if lit >> (TOTAL_DIGIT_BITS - 1 - spec_segment(seg)) & 1:
+                    mask |= 1 << y
+                    break
+        columns.append(mask)
+    return columns
+
+class Marquee:
+    """Long text laid out once, then scrolled by sliding over it
+
+    By default the text is padded with a screenful of spaces on both sides so that it scrolls in
+    from the right and out to the left. Frames can step a whole digit (render, exact glyphs) or a
+    pixel column (render_smooth, at pixel grid resolution). Either way the cost per frame depends
+    on the window size only, not the text length.
+    """
+    def __init__(self, font, text, panels=1, padded=True):
+        self.panels = panels
+        self.width = panels * DIGITS
+        if padded:
+            text = ' ' * self.width + text + ' ' * self.width
+        self.text = text
+        # a panel shows its upper data rightmost digit first and lower data leftmost first, so with
+        # the upper strip reversed both are a single contiguous slice per panel
+        n = len(text)
+        glyphs = [glyph_index(ord(ch)) for ch in text]
+        self.upper = b''.join(bytes(font.upper_stamps[glyph]) for glyph in reversed(glyphs))
+        self.lower = b''.join(bytes(font.lower_stamps[glyph]) for glyph in glyphs)
+        self.upper_end = n * UPPER_DIGIT_BYTES
+        self.steps = n - self.width + 1
+        # one row bitmask per pixel column of the whole text
+        glyph_cache = {}
+        self.columns = []
+        for ch in text:
+            if ch not in glyph_cache:
+                glyph_cache[ch] = glyph_columns(font.get_glyph_data(ord(ch)))
+            self.columns += glyph_cache[ch]
+        self.smooth_steps = (self.steps - 1) * W + 1
+        self.column_bits = column_bits(panels)
+        # [display column] -> {row bitmask: wire bits}, filled in as the masks come up
+        self.column_cache = [{} for _ in range(self.width * W)]
+
+    def render(self, window, step):
+        """Show text[step:step + width]"""
+        buf = window.buf
+        upper_len = DIGITS * UPPER_DIGIT_BYTES
+        lower_len = DIGITS * LOWER_DIGIT_BYTES
+        for panel in range(self.panels):
+            panel_off = (self.panels - 1 - panel) * BYTES
+            first = step + panel * DIGITS
+            upper = self.upper_end - (first + DIGITS) * UPPER_DIGIT_BYTES
+            lower = first * LOWER_DIGIT_BYTES
+            buf[panel_off:panel_off + upper_len] = self.upper[upper:upper + upper_len]
+            buf[panel_off + upper_len:panel_off + BYTES] = self.lower[lower:lower + lower_len]
+
+    def column_wire_bits(self, column, mask):
+        cache = self.column_cache[column]
+        bits = cache.get(mask)
+        if bits is None:
+            bits = 0
+            rows = self.column_bits[column]
+            for y in range(1 + H):
+                if mask & (1 << y):
+                    bits |= rows[y]
+            cache[mask] = bits
+        return bits
+
+    def render_smooth(self, window, column):
+        """Show the pixel columns from column on"""
+        lit = 0
+        for (i, mask) in enumerate(self.columns[column:column + self.width * W]):
+            if mask:
+                lit |= self.column_wire_bits(i, mask)
+        window.buf[:] = lit.to_bytes(len(window.buf), 'big')
+
+    def frames(self, window=None, smooth=False):
+        """Every step in turn, drawn in the same window"""
+        if window is None:
+            window = Window(self.panels)
+        if smooth:
+            for column in range(self.smooth_steps):
+                self.render_smooth(window, column)
+                yield window
+        else:
+            for step in range(self.steps):
+                self.render(window, step)
+                yield window
+
+def unit_test_marquee():
+    # no firmware image needed, any bytes will do as glyphs
+    font = Font(None)
+    font._data = bytes((i * 37 + 11) & 0xff for i in range(GLYPHS * TOTAL_DIGIT_BYTES))
+    # past latin-1 is blank, not an error
+    window = Window()
+    font.render(window, 'a\u20acbc')
+    expected = Window()
+    for digit in (0, 2, 3):
+        font.render_glyph(expected, digit, ord('a\u20acbc'[digit]))
+    assert window.buf == expected.buf
+    assert bytes(font.get_glyph_data(0x20ac)) == bytes(TOTAL_DIGIT_BYTES)
+    Marquee(font, 'a\u20acbc').render(window, DIGITS)
+    assert window.buf == expected.buf
+    for panels in (1, 2):
+        marquee = Marquee(font, 'Hello, world', panels)
+        window = Window(panels)
+        expected = Window(panels)
+        for step in (0, 3, marquee.steps - 1):
+            marquee.render(window, step)
+            font.render(expected, marquee.text[step:step + marquee.width])
+            assert window.buf == expected.buf
+        for column in (0, 3 * W + 2, marquee.smooth_steps - 1):
+            marquee.render_smooth(window, column)
+            expected = Window(panels)
+            for d in range(marquee.width):
+                for x in range(W):
+                    mask = marquee.columns[column + d * W + x]
+                    for y in range(1 + H):
+                        if mask & (1 << y):
+                            expected.putpixel(d, x, y - 1)
+            assert window.buf == expected.buf
+
+unit_test_marquee()
+
+class FrameScheduler:
+    """Paces frames against absolute deadlines on a monotonic clock
+
+    Unlike sleeping a fixed time after each frame, the time spent rendering and sending counts
+    toward the frame period, so the rate doesn't drift below the target. When running late by a
+    whole period or more, the missed frames are skipped (the default) or, with catch_up, shown
+    back to back without sleeping until on schedule again.
+    """
+    def __init__(self, fps, catch_up=False):
+        self.fps = fps
+        self.period = 1.0 / fps
+        self.catch_up = catch_up
+        self.start()
+
+    def start(self):
+        self.t0 = monotonic()
+        self.deadline = self.t0 + self.period
+        self.frames = 0
+        self.skipped = 0
+        self.shown_at = [self.t0]
+
+    def tick(self):
+        """Wait for the next deadline; return how many frames to skip to get back on schedule"""
+        self.frames += 1
+        now = monotonic()
+        if now < self.deadline:
+            sleep(self.deadline - now)
+            now = monotonic()
+        self.shown_at.append(now)
+        behind = int((now - self.deadline) / self.period)
+        if behind > 0 and not self.catch_up:
+            self.deadline += (1 + behind) * self.period
+            self.skipped += behind
+            return behind
+        self.deadline += self.period
+        return 0
+
+    def run(self, callback, nframes):
+        """Call callback(frame_number) for each frame on time, leaving out skipped ones"""
+        self.start()
+        n = 0
+        while n < nframes:
+            callback(n)
+            n += 1 + self.tick()
+        return self.stats()
+
+    def play(self, display, windows):
+        """Blit each window from an iterable on time; skipped ones are consumed but not sent"""
+        stats = getattr(display, 'stats', None)
+        if stats is not None:
+            windows = stats.timed('render', windows)
+        self.start()
+        skip = 0
+        for window in windows:
+            if skip > 0:
+                skip -= 1
+                continue
+            display.blit(window)
+            skip = self.tick()
+        return self.stats()
+
+    def stats(self):
+        """Achieved vs. target rate, and jitter as the std dev of frame intervals in seconds"""
+        intervals = [b - a for (a, b) in zip(self.shown_at, self.shown_at[1:])]
+        elapsed = self.shown_at[-1] - self.t0
+        return {
+            'target_fps': self.fps,
+            'achieved_fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'jitter': pstdev(intervals) if intervals else 0.0,
+            'frames': self.frames,
+            'skipped': self.skipped,
+        }
 
 def rolldemo(display):
     spf = 0.04
     # each digit up to down
-    for d in range(display.num_digits()):
-        for y in range(H):
-            window = display.new_window()
-            window.fillx(d, y)
-            display.blit(window)
-            sleep(spf/2)
+    def down():
+        for d in range(display.num_digits()):
+            for y in range(H):
+                window = display.new_window()
+                window.fillx(d, y)
+                yield window
     # each digit left to right
-    for d in range(display.num_digits()):
-        for x in range(W):
-            window = display.new_window()
-            window.filly(d, x)
-            display.blit(window)
-            sleep(spf)
+    def right():
+        for d in range(display.num_digits()):
+            for x in range(W):
+                window = display.new_window()
+                window.filly(d, x)
+                yield window
+    return [
+        FrameScheduler(2 / spf).play(display, down()),
+        FrameScheduler(1 / spf).play(display, right()),
+    ]
 
 def flowdemo(display):
     spf = 0.05
-    window = display.new_window()
-    # draw and clear top to bottom
-    for color in [1, 0]:
-        for y in range(H):
-            for d in range(window.num_digits()):
-                window.fillx(d, y, color)
-            display.blit(window)
-            sleep(spf)
+    def frames():
+        window = display.new_window()
+        # draw and clear top to bottom
+        for color in [1, 0]:
+            for y in range(H):
+                for d in range(window.num_digits()):
+                    window.fillx(d, y, color)
+                yield window
 
-    window = display.new_window()
-    # draw and clear left to right
-    for color in [1, 0]:
-        for d in range(window.num_digits()):
-            for x in range(W):
-                window.filly(d, x, color)
-                display.blit(window)
-                sleep(spf)
+        window = display.new_window()
+        # draw and clear left to right
+        for color in [1, 0]:
+            for d in range(window.num_digits()):
+                for x in range(W):
+                    window.filly(d, x, color)
+                    yield window
+    return [FrameScheduler(1 / spf).play(display, frames())]
 
 def pixelchasedemo(display):
     # experiencing some flicker trouble with a higher rate when using multiple panels, likely due to
     # the proxy latching on every panel.
     spf = 0.03
-    window = display.new_window()
-    # top to bottom
-    for y in range(H):
-        # left to right, then right to left
-        direction = 1 - ((y & 1) * 2)
-        for d in (range(window.num_digits())[::direction]):
-            for x in range(W)[::direction]:
-                window.putpixel(d, x, y)
-                display.blit(window)
-                sleep(spf)
+    def frames():
+        window = display.new_window()
+        # top to bottom
+        for y in range(H):
+            # left to right, then right to left
+            direction = 1 - ((y & 1) * 2)
+            for d in (range(window.num_digits())[::direction]):
+                for x in range(W)[::direction]:
+                    window.putpixel(d, x, y)
+                    yield window
+    return [FrameScheduler(1 / spf).play(display, frames())]
 
 def blinkydemo(display):
     spf = 0.10
-    for i in range(20):
-        window = display.new_window()
-        if (i+1) & 1:
-            window.fill()
-        display.blit(window)
-        sleep(spf)
+    def frames():
+        for i in range(20):
+            window = display.new_window()
+            if (i+1) & 1:
+                window.fill()
+            yield window
+    return [FrameScheduler(1 / spf).play(display, frames())]
+
+def marqueedemo(display, font):
+    spf = 0.04
+    marquee = Marquee(font, 'Helsinki-Vantaa: departures on time, gate changes shown here',
+            display.panels)
+    return [FrameScheduler(1 / spf).play(display, marquee.frames(smooth=True))]
+
+def print_stats(name, stats):
+    print("%s: %.2f/%.2f fps, jitter %.2f ms, %d frames, %d skipped" % (
+        name, stats['achieved_fps'], stats['target_fps'], 1000.0 * stats['jitter'],
+        stats['frames'], stats['skipped']))
 
 def explore_font(display, font):
     window = display.new_window()
@@ -343,11 +1320,10 @@ def explore_font(display, font):
 
     a = time()
 
-    for glyph in range(-width + 1, 256 - width + 1):
-        window = display.new_window()
-        for digit in range(width):
-            if glyph + digit >= 0:
-                font.render_glyph(window, digit, glyph + digit)
+    # every glyph in order, scrolling in from the right
+    marquee = Marquee(font, ' ' * (width - 1) + ''.join(map(chr, range(256))), display.panels,
+            padded=False)
+    for window in marquee.frames():
         display.blit(window)
         #sleep(0.0001)
 
@@ -359,27 +1335,54 @@ def explore_font(display, font):
 
     sleep(2)
 
-def main():
-    serial_filename = argv[1]
-    zel09101_fw_filename = argv[2]
-    num_panels = int(argv[3])
-
-    ser = Serial(argv[1], 115200, exclusive=True, timeout=0)
+def open_port(serial_filename):
+    ser = Serial(serial_filename, 115200, exclusive=True, timeout=0)
     # faster uart seems to be glitchy
-    #ser = Serial(argv[1], 230400, exclusive=True, timeout=0)
+    #ser = Serial(serial_filename, 230400, exclusive=True, timeout=0)
+    return ser
+
+def open_display(ports_arg, num_panels, firmware='ino'):
+    """Display for the command line port argument: several comma separated ports, left to right,
+    for a board split over many proxies; or "emu" for a window with pixel_gfx
+
+    num_panels is per port; firmware is what the proxies run, "ino" or "c", for their acks.
+    """
+    ack_bytes = FIRMWARE_ACK_BYTES[firmware]
+    serial_filenames = ports_arg.split(',')
+
+    if serial_filenames == ['emu']:
+        import pixel_gfx
+        return pixel_gfx.EmulatorDisplay(num_panels, per_row=min(32, num_panels * DIGITS))
+
+    ports = [open_port(serial_filename) for serial_filename in serial_filenames]
     sleep(2)
-    r = ser.read(9999999)
-    #print("flush size", len(r), r)
+    for ser in ports:
+        r = ser.read(9999999)
+        #print("flush size", len(r), r)
+
+    if len(ports) == 1:
+        return Display(ports[0], num_panels, ack_bytes=ack_bytes)
+    return MultiDisplay([Display(ser, num_panels, ack_bytes=ack_bytes) for ser in ports],
+            sync_latch=True)
 
+def main():
+    zel09101_fw_filename = argv[2]
+    # per port
+    num_panels = int(argv[3])
+    # "c" for proxies running proxy.c
+    firmware = argv[4] if len(argv) >= 5 else 'ino'
+    display = open_display(argv[1], num_panels, firmware)
     font = Font(zel09101_fw_filename)
+    run_demos(display, font)
 
-    display = Display(ser, num_panels)
+def run_demos(display, font):
     explore_font(display, font)
     while True:
-        pixelchasedemo(display)
-        rolldemo(display)
-        flowdemo(display)
-        blinkydemo(display)
+        for demo in (pixelchasedemo, rolldemo, flowdemo, blinkydemo):
+            for stats in demo(display):
+                print_stats(demo.__name__, stats)
+        for stats in marqueedemo(display, font):
+            print_stats('marqueedemo', stats)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+import os
+import tty
+from collections import deque
+from sys import argv
+from threading import Thread
+from time import sleep, monotonic
+import pixel_map
+
+# Software stand-in for the proxy firmware and the chain of panels behind it, for running
+# pixel_map without hardware. Either use FakeSerial in-process in place of a Serial, or run this
+# as a script to get a pseudo-terminal that pixel_map.py can open like the real thing.
+
+# proxy.c: 1 MBaud, one 0xff back per latch
+FIRMWARE_C = 'c'
+# proxy.ino: 115200 baud, the running index (0 to max_index - 1) back per byte plus a '.' per latch
+FIRMWARE_INO = 'ino'
+
+BAUD = {
+    FIRMWARE_C: 1000000,
+    FIRMWARE_INO: 115200,
+}
+
+class ProxyEmulator:
+    """The proxy and its panels, one SPI transfer per received byte
+
+    The chain is a shift register of panels * 60 bytes; the first bytes sent end up in the last
+    panel of the chain. Latched frames are kept in wire order, i.e. exactly like a Window's buffer.
+    """
+    def __init__(self, panels=1, firmware=FIRMWARE_INO, keep_frames=16):
+        self.panels = panels
+        self.firmware = firmware
+        self.chain = deque([0] * (panels * pixel_map.BYTES), maxlen=panels * pixel_map.BYTES)
+        self.max_index = self.detect_size()
+        self.index = 0
+        # sent back to the host, read with FakeSerial.read or over the pty
+        self.tx = bytearray()
+        self.latched = deque(maxlen=keep_frames)
+        self.latches = 0
+        if firmware == FIRMWARE_INO:
+            # proxy.ino reports its detected size at boot, as (byte)max_index / 60: the cast comes
+            # first, so it's only right for up to 4 panels
+            self.tx.append((self.max_index & 0xff) // pixel_map.BYTES)
+
+    def spi_transfer(self, data):
+        back = self.chain[0]
+        self.chain.append(data)
+        return back
+
+    def loopback_pattern(self, pattern, limit):
+        # the shift register loops back to MISO, so the pattern shows up after a full chain
+        for n in range(limit):
+            if self.spi_transfer(pattern) == pattern:
+                return n
+        return None
+
+    def detect_size(self):
+        """Count transfers until each of three patterns comes back, like both firmwares do
+
+        The count is the chain length for both. proxy.c's spiWaitForRepeat counts the transfer
+        that brings the pattern back too, so on a bare shift register like this one it would come
+        out one higher; that is not modelled, so that the emulated proxy.c latches whole frames.
+        """
+        if self.firmware == FIRMWARE_C:
+            # u8 counter, 255 means failure and is used as is
+            limit = 255
+            fallback = 255
+        else:
+            limit = 100 * pixel_map.BYTES
+            fallback = pixel_map.BYTES
+        sizes = [self.loopback_pattern(pattern, limit) for pattern in (0x55, 0x33, 0x0f)]
+        if sizes[0] is not None and sizes[0] == sizes[1] == sizes[2]:
+            return sizes[0]
+        return fallback
+
+    def receive(self, data):
+        """Feed bytes from the host as if over the uart"""
+        for byte in data:
+            if self.firmware == FIRMWARE_INO:
+                # the index before this byte, low byte only
+                self.tx.append(self.index & 0xff)
+            self.spi_transfer(byte)
+            self.index += 1
+            if self.index == self.max_index:
+                self.index = 0
+                self.tx.append(0xff if self.firmware == FIRMWARE_C else ord('.'))
+                self.latch()
+
+    def latch(self):
+        self.latched.append(bytes(self.chain))
+        self.latches += 1
+
+    def take_tx(self, n=None):
+        if n is None:
+            n = len(self.tx)
+        data = bytes(self.tx[:n])
+        del self.tx[:n]
+        return data
+
+    def text(self, font, frame=None):
+        """What the panels show as text, by matching each digit to the font; '?' if no match"""
+        if frame is None:
+            frame = self.latched[-1]
+        return ''.join(
+            chr(glyph) if glyph is not None else '?'
+            for glyph in font_lookup(font, decode_digits(frame, self.panels)))
+
+def decode_digits(frame, panels):
+    """Split a wire order frame back into per-digit glyph-layout data, left to right"""
+    digits = []
+    for (upper_off, lower_off) in pixel_map.digit_byte_offsets(panels):
+        upper = frame[upper_off:upper_off + pixel_map.UPPER_DIGIT_BYTES]
+        lower = frame[lower_off:lower_off + pixel_map.LOWER_DIGIT_BYTES]
+        digits.append(bytes(upper) + bytes(lower))
+    return digits
+
+def font_lookup(font, digits):
+    table = {}
+    # for identical glyphs (like all the blank ones), printable ascii wins, then the lowest code
+    order = list(reversed(range(pixel_map.GLYPHS))) + list(reversed(range(32, 127)))
+    for glyph in order:
+        table[bytes(font.upper_stamps[glyph]) + bytes(font.lower_stamps[glyph])] = glyph
+    return [table.get(digit) for digit in digits]
+
+class FakeSerial:
+    """Enough of serial.Serial for pixel_map.Display, backed by a ProxyEmulator
+
+    With baud set, writes take as long as the bytes would on the wire at 10 bits per byte. With
+    latency set, what the proxy sends back can be read only that many seconds later, like over
+    usb.
+    """
+    def __init__(self, emulator, baud=None, timeout=0, latency=0.0):
+        self.emulator = emulator
+        self.baud = baud
+        self.timeout = timeout
+        self.latency = latency
+        self.bytes_written = 0
+        # (readable from, data) from the emulator, and what's readable already
+        self.in_transit = deque()
+        self.rx = bytearray(emulator.take_tx())
+
+    def receive(self):
+        now = monotonic()
+        while self.in_transit and self.in_transit[0][0] <= now:
+            self.rx += self.in_transit.popleft()[1]
+
+    @property
+    def in_waiting(self):
+        self.receive()
+        return len(self.rx)
+
+    def write(self, data):
+        if self.baud is not None:
+            sleep(len(data) * 10.0 / self.baud)
+        self.emulator.receive(data)
+        self.in_transit.append((monotonic() + self.latency, self.emulator.take_tx()))
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self, n=1):
+        self.receive()
+        if not self.rx and self.in_transit and self.timeout:
+            # like a blocking read, up to timeout
+            sleep(max(0.0, min(self.timeout, self.in_transit[0][0] - monotonic())))
+            self.receive()
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def close(self):
+        pass
+
+class PtyProxy:
+    """Serve a ProxyEmulator on a pseudo-terminal; open slave_name with pyserial as usual"""
+    def __init__(self, emulator, baud=None):
+        self.emulator = emulator
+        self.baud = baud
+        (self.master, slave) = os.openpty()
+        tty.setraw(slave)
+        self.slave = slave
+        self.slave_name = os.ttyname(slave)
+        self.running = True
+        # proxy.ino's boot byte is there before the host writes anything
+        tx = emulator.take_tx()
+        if tx:
+            os.write(self.master, tx)
+        self.thread = Thread(target=self.serve, name="proxy emulator", daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if self.baud is not None:
+                sleep(len(data) * 10.0 / self.baud)
+            self.emulator.receive(data)
+            tx = self.emulator.take_tx()
+            if tx:
+                os.write(self.master, tx)
+
+    def close(self):
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+class FailingSerial(FakeSerial):
+    def write(self, data):
+        raise OSError("unplugged")
+
+def unit_test_emu():
+    for firmware in (FIRMWARE_INO, FIRMWARE_C):
+        emu = ProxyEmulator(2, firmware)
+        # the chain length for both, see detect_size
+        assert emu.max_index == 2 * pixel_map.BYTES
+        ack_bytes = pixel_map.FIRMWARE_ACK_BYTES[firmware]
+        port = FakeSerial(emu)
+        port.read(9999999)
+        display = pixel_map.Display(port, 2, ack_bytes=ack_bytes)
+        window = display.new_window()
+        window.putpixel(7, 4, 6)
+        display.blit(window)
+        assert emu.latched[-1] == bytes(window.buf)
+        window.fill()
+        display.blit(window)
+        assert emu.latched[-1] == bytes(window.buf)
+        assert emu.latches == 2
+        # every ack accounted for
+        display.close()
+        assert not display.pending_acks and port.in_waiting == 0
+
+    # proxy.ino's acks and boot byte, as the firmware computes them
+    emu = ProxyEmulator(5)
+    assert emu.take_tx() == bytes([(5 * pixel_map.BYTES & 0xff) // pixel_map.BYTES])
+    emu.receive(bytes(5 * pixel_map.BYTES))
+    assert emu.take_tx() == bytes(i & 0xff for i in range(5 * pixel_map.BYTES)) + b'.'
+
+unit_test_emu()
+
+def unit_test_threaded():
+    # slow enough on the wire that the queue overflows
+    emu = ProxyEmulator(1, keep_frames=64)
+    port = FakeSerial(emu, baud=115200)
+    port.read(9999999)
+    display = pixel_map.ThreadedDisplay(port, 1, depth=2)
+    frames = []
+    for n in range(20):
+        window = display.new_window()
+        window.putpixel(n % pixel_map.DIGITS, n % pixel_map.W, n // pixel_map.DIGITS)
+        display.blit(window)
+        frames.append(bytes(window.frame()))
+    display.sync()
+    assert not display.pending_acks and port.in_waiting == 0
+    latched = list(emu.latched)
+    assert display.frames_dropped > 0
+    assert len(latched) + display.frames_dropped == len(frames)
+    # whatever made it out went in order, and the newest frame is never dropped
+    positions = [frames.index(frame) for frame in latched]
+    assert positions == sorted(positions) and positions[-1] == len(frames) - 1
+    window.fill()
+    display.blit(window)
+    display.close()
+    assert emu.latched[-1] == bytes(window.buf)
+    assert not display.pending_acks and port.in_waiting == 0
+
+    # a write error comes out of the next blit and out of close
+    display = pixel_map.ThreadedDisplay(FailingSerial(ProxyEmulator(1)), 1)
+    window = display.new_window()
+    display.blit(window)
+    display.thread.join()
+    window.fill()
+    for call in (lambda: display.blit(window), display.close):
+        try:
+            call()
+        except OSError:
+            pass
+        else:
+            assert False, "write error not raised"
+
+unit_test_threaded()
+
+def unit_test_multi():
+    for sync_latch in (False, True):
+        emus = [ProxyEmulator(1), ProxyEmulator(2)]
+        ports = [FakeSerial(emu) for emu in emus]
+        for port in ports:
+            port.read(9999999)
+        displays = [pixel_map.Display(port, emu.panels) for (port, emu) in zip(ports, emus)]
+        display = pixel_map.MultiDisplay(displays, sync_latch)
+        window = display.new_window()
+        # digit 0 is on the leftmost panel, which is the first display
+        window.putpixel(0, 1, 2)
+        window.putpixel(11, 3, 4)
+        display.blit(window)
+        frame = bytes(window.frame())
+        assert emus[0].latched[-1] == frame[2 * pixel_map.BYTES:]
+        assert emus[1].latched[-1] == frame[:2 * pixel_map.BYTES]
+        display.blit(window)
+        assert display.frames_skipped == 1
+        # only the second chain has something new
+        window.putpixel(11, 0, 0)
+        display.blit(window)
+        assert display.frames_skipped == 1
+        assert emus[0].latches == (2 if sync_latch else 1) and emus[1].latches == 2
+        display.close()
+
+        # a failing chain raises instead of leaving the others waiting at the latch
+        emus = [ProxyEmulator(1), ProxyEmulator(1)]
+        ports = [FakeSerial(emus[0]), FailingSerial(emus[1])]
+        ports[0].read(9999999)
+        displays = [pixel_map.Display(port, 1) for port in ports]
+        display = pixel_map.MultiDisplay(displays, sync_latch)
+        window = display.new_window()
+        window.fill()
+        try:
+            display.blit(window)
+        except OSError:
+            pass
+        else:
+            assert False, "write error not raised"
+        assert emus[0].latches == 1
+        display.close()
+
+unit_test_multi()
+
+def main():
+    panels = int(argv[1]) if len(argv) >= 2 else 1
+    firmware = argv[2] if len(argv) >= 3 else FIRMWARE_INO
+    emu = ProxyEmulator(panels, firmware)
+    proxy = PtyProxy(emu, BAUD[firmware])
+    print("emulating %s with %d panels on %s" % (firmware, panels, proxy.slave_name))
+    print("run ./pixel_map.py %s ROM %d %s" % (proxy.slave_name, panels, firmware))
+    prev = 0
+    a = monotonic()
+    try:
+        while True:
+            sleep(1)
+            b = monotonic()
+            print("%d frames latched, %.2f fps" % (emu.latches, (emu.latches - prev) / (b - a)))
+            (prev, a) = (emu.latches, b)
+    except KeyboardInterrupt:
+        proxy.close()
+
+if __name__ == "__main__":
+    main()